@@ -0,0 +1,33 @@
+global
+    daemon
+    maxconn 4096
+    # the daemon updates servers through this socket, instead of reload.
+    stats socket /var/run/haproxy.sock mode 600 level admin
+
+defaults
+    mode http
+    timeout connect 5s
+    timeout client 30s
+    timeout server 30s
+
+frontend http
+    bind *:{{ HTTP_PORT }}
+{% for proxy_detail in proxy_details %}
+    use_backend {{ proxy_detail.name }} if { hdr(host) -i {{ proxy_detail.name }} }
+{% endfor %}
+    default_backend unavailable
+
+{% for proxy_detail in proxy_details %}
+backend {{ proxy_detail.name }}
+    balance roundrobin
+{% for server, node in proxy_slots[proxy_detail.name] %}
+{% if node %}
+    server {{ server }} {{ node.addr }}:{{ node.port }} weight {{ node.weight }} check
+{% else %}
+    server {{ server }} 127.0.0.1:1 check disabled
+{% endif %}
+{% endfor %}
+
+{% endfor %}
+backend unavailable
+    http-request deny deny_status 503
@@ -8,8 +8,8 @@
 
 {% for proxy_detail in proxy_details %}
     {{ upstream(proxy_detail.name, proxy_detail.nodes) }}
-    {% for proxy_group in proxy_detail.nodes|groupby('proto') %}
-    {% if proxy_group.grouper == 'http' %}
+    {% for proxy_group in proxy_groups[proxy_detail.name] %}
+    {% if proxy_group.proto == 'http' %}
     server {
         server_name {{ proxy_detail.name }};
         listen 80;
@@ -0,0 +1,61 @@
+"""
+    compiled jsonselect selectors for hot paths.
+"""
+
+import re
+
+import jsonselect
+
+__all__ = ['compile', 'select', 'select_keys']
+
+_KEY_SELECTOR = re.compile(r'^\s*\.([A-Za-z_][\w-]*)\s*$')
+_compiled_selectors = {}
+
+
+def compile(selector):
+    """
+    compile selector once, a single key selector like '.a' becomes a lookup of the key in obj,
+    others fall back to jsonselect. unlike jsonselect, the lookup never matches the key deeper
+    in obj, so only use it on flat dicts; use select_keys to walk a path of child keys.
+
+    :param selector:
+    :return: a function which selects from obj, returns None if not found.
+    """
+    accessor = _compiled_selectors.get(selector)
+    if accessor:
+        return accessor
+
+    key_match = _KEY_SELECTOR.match(selector)
+    if key_match:
+        key = key_match.group(1)
+        accessor = lambda obj: obj.get(key) if isinstance(obj, dict) else None
+    else:
+        accessor = lambda obj: jsonselect.select(selector, obj)
+
+    _compiled_selectors[selector] = accessor
+    return accessor
+
+
+def select(obj, selector):
+    """
+
+    :param obj:
+    :param selector:
+    :return:
+    """
+    return compile(selector)(obj)
+
+
+def select_keys(obj, keys):
+    """
+    walk obj through keys, returns None if any key is missing.
+
+    :param obj:
+    :param keys:
+    :return:
+    """
+    for key in keys:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
@@ -28,6 +28,30 @@ def _get_callargs():
                         default=os.getenv(constants.DOCKER_URL_ENV, 'unix:///var/run/docker.sock'),
                         help='docker daemon addr, default is unix:///var/run/docker.sock.')
 
+    parser.add_argument('-discovery', dest='discovery', choices=[events.DISCOVERY_ENV, events.DISCOVERY_LABEL],
+                        default=os.getenv(constants.DISCOVERY_ENV, events.DISCOVERY_ENV),
+                        help='discover proxy settings from container env or labels only, default is env.')
+
+    parser.add_argument('-heartbeat-workers', dest='heartbeat_workers', type=int,
+                        default=os.getenv(constants.HEARTBEAT_WORKERS_ENV, 8),
+                        help='how many containers to heartbeat concurrently, default is 8.')
+
+    parser.add_argument('-heartbeat-interval', dest='heartbeat_interval', type=float,
+                        default=os.getenv(constants.HEARTBEAT_INTERVAL_ENV, 30),
+                        help='seconds between two heartbeats, default is 30.')
+
+    parser.add_argument('-heartbeat-ttl', dest='heartbeat_ttl', type=int,
+                        default=os.getenv(constants.HEARTBEAT_TTL_ENV, 60),
+                        help='seconds a node lives in backend without heartbeat, default is 60.')
+
+    parser.add_argument('-heartbeat-jitter', dest='heartbeat_jitter', type=float,
+                        default=os.getenv(constants.HEARTBEAT_JITTER_ENV, 5),
+                        help='max random seconds to add to or remove from each interval, default is 5.')
+
+    parser.add_argument('-heartbeat-rate', dest='heartbeat_rate', type=float,
+                        default=os.getenv(constants.HEARTBEAT_RATE_ENV),
+                        help='max backend writes per second while heartbeating, default is unlimited.')
+
     parser.add_argument('--docker-tlsverify', dest='docker_tls_verify',
                         default=os.getenv(constants.DOCKER_TLSVERIFY_ENV, False), action='store_true')
 
@@ -46,6 +70,16 @@ def _get_callargs():
 def main():
     callargs = _get_callargs()
 
+    if callargs.heartbeat_ttl <= callargs.heartbeat_interval + callargs.heartbeat_jitter:
+        _logger.e('heartbeat ttl must be greater than heartbeat interval plus jitter, program exit.')
+        sys.exit(1)
+
+    # a sweep must refresh at least one node at rate before the ttl of the previous one ends.
+    heartbeat_slack = callargs.heartbeat_ttl - callargs.heartbeat_interval - callargs.heartbeat_jitter
+    if callargs.heartbeat_rate and callargs.heartbeat_rate * heartbeat_slack < 1:
+        _logger.e('heartbeat rate must allow one write in heartbeat ttl minus interval and jitter, program exit.')
+        sys.exit(1)
+
     backend_url = callargs.backend
     if not backend_url:
         _logger.e('%s env not set, use -backend instead, program exit.', constants.BACKEND_ENV)
@@ -58,7 +92,13 @@ def main():
         sys.exit(1)
 
     backend = backend_cls(backend_url)
-    events.loop(backend, callargs.docker_url)
+    events.loop(backend, callargs.docker_url,
+                workers=callargs.heartbeat_workers,
+                discovery=callargs.discovery,
+                interval=callargs.heartbeat_interval,
+                ttl=callargs.heartbeat_ttl,
+                jitter=callargs.heartbeat_jitter,
+                rate=callargs.heartbeat_rate)
 
 
 if __name__ == '__main__':
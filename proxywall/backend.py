@@ -1,39 +1,62 @@
 import abc
+import collections
 import json
 import urlparse
 
 import etcd
-import jsonselect
 
 from proxywall import loggers
 from proxywall.commons import *
 from proxywall.errors import *
 
-__all__ = ["ProxyNode", "ProxyDetail", "Backend", "EtcdBackend"]
+__all__ = ["ProxyNode", "ProxyDetail", "ProxyEvent", "Backend", "EtcdBackend"]
 
 
-class ProxyNode(object):
+_ProxyNode = collections.namedtuple('ProxyNode', ['uuid', 'addr', 'port', 'proto', 'redirect', 'network', 'weight'])
+
+# networks and protos repeat across nodes and come from a few values, keep one copy of each,
+# addrs churn with containers and would grow the table forever.
+_interned_values = {}
+
+
+def _intern(value):
+    return _interned_values.setdefault(value, value) if value is not None else None
+
+
+def _weight(weight):
+    # weights come from labels and json as strings too, anything not a positive number weighs 1.
+    try:
+        weight = int(weight)
+    except (TypeError, ValueError):
+        return 1
+    return weight if weight > 0 else 1
+
+
+class ProxyNode(_ProxyNode):
     """
 
     """
 
+    __slots__ = ()
+
     ALLOW_PROTOS = ['http', 'https']
     DEFAULT_PROTO = ALLOW_PROTOS[0]
 
-    def __init__(self,
-                 uuid=None, addr=None, port=None,
-                 proto=None, redirect=None, network=None, weight=None):
+    def __new__(cls,
+                uuid=None, addr=None, port=None,
+                proto=None, redirect=None, network=None, weight=None):
 
         if proto and proto not in ProxyNode.ALLOW_PROTOS:
             raise ValueError('')
 
-        self._uuid = uuid
-        self._addr = addr
-        self._port = port
-        self._proto = proto if proto else ProxyNode.DEFAULT_PROTO
-        self._redirect = redirect
-        self._network = network
-        self._weight = weight if weight and weight >= 0 else 1
+        return super(ProxyNode, cls).__new__(cls,
+                                             uuid,
+                                             addr,
+                                             port,
+                                             _intern(proto if proto else ProxyNode.DEFAULT_PROTO),
+                                             redirect,
+                                             _intern(network),
+                                             _weight(weight))
 
     def __eq__(self, other):
         if self is other:
@@ -42,57 +65,33 @@ class ProxyNode(object):
         if not isinstance(other, ProxyNode):
             return False
 
-        return (self._addr, self._port,) == \
-               (other._addr, other._port,)
+        return (self.addr, self.port,) == \
+               (other.addr, other.port,)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self._addr, self._port,))
-
-    @property
-    def uuid(self):
-        return self._uuid
-
-    @property
-    def addr(self):
-        return self._addr
-
-    @property
-    def port(self):
-        return self._port
-
-    @property
-    def redirect(self):
-        return self._redirect
-
-    @property
-    def proto(self):
-        return self._proto
-
-    @property
-    def network(self):
-        return self._network
-
-    @property
-    def weight(self):
-        return self._weight
+        return hash((self.addr, self.port,))
 
     def to_dict(self):
-        return {'uuid': self._uuid, 'addr': self._addr, 'port': self._port,
-                'proto': self._proto, 'redirect': self._redirect, 'network': self._network,
-                'weight': self._weight}
+        return {'uuid': self.uuid, 'addr': self.addr, 'port': self.port,
+                'proto': self.proto, 'redirect': self.redirect, 'network': self.network,
+                'weight': self.weight}
 
     @staticmethod
     def from_dict(dict_obj):
-        return ProxyNode(uuid=jsonselect.select('.uuid', dict_obj),
-                         addr=jsonselect.select('.addr', dict_obj),
-                         port=jsonselect.select('.port', dict_obj),
-                         proto=jsonselect.select('.proto', dict_obj),
-                         redirect=jsonselect.select('.redirect', dict_obj),
-                         network=jsonselect.select('.network', dict_obj),
-                         weight=jsonselect.select('.weight', dict_obj))
+        return ProxyNode(uuid=dict_obj.get('uuid'),
+                         addr=dict_obj.get('addr'),
+                         port=dict_obj.get('port'),
+                         proto=dict_obj.get('proto'),
+                         redirect=dict_obj.get('redirect'),
+                         network=dict_obj.get('network'),
+                         weight=dict_obj.get('weight'))
+
+    @staticmethod
+    def from_json(json_value):
+        return ProxyNode.from_dict(json.loads(json_value))
 
 
 class ProxyDetail(object):
@@ -100,9 +99,11 @@ class ProxyDetail(object):
 
     """
 
+    __slots__ = ('_name', '_nodes')
+
     def __init__(self, name, nodes=None):
         self._name = name
-        self._nodes = (nodes | as_set | as_list) if nodes else []
+        self._nodes = (nodes | as_set | sort(key=lambda it: (it.addr, it.port, it.uuid)) | as_tuple) if nodes else ()
 
     @property
     def name(self):
@@ -118,12 +119,21 @@ class ProxyDetail(object):
 
     @staticmethod
     def from_dict(dict_obj):
-        name = jsonselect.select('.name', dict_obj)
-        nodes = jsonselect.select('.nodes', dict_obj)
+        name = dict_obj.get('name')
+        nodes = dict_obj.get('nodes') or []
         return ProxyDetail(name,
                            nodes=nodes | collect(lambda it: ProxyNode.from_dict(it)) | as_list)
 
 
+class ProxyEvent(collections.namedtuple('ProxyEvent', ['action', 'name', 'uuid', 'node', 'index'])):
+    """
+    a change of one node, node is None when it was removed or is not available.
+    name is None when the change is not about a single node, e.g. a removed directory.
+    """
+
+    __slots__ = ()
+
+
 class Backend(object):
     """
 
@@ -157,6 +167,18 @@ class Backend(object):
         """
         pass
 
+    @abc.abstractmethod
+    def refresh(self, name, node, ttl):
+        """
+        extend the ttl of a registered node without rewriting its value.
+
+        :param name:
+        :param node:
+        :param ttl:
+        :return:
+        """
+        pass
+
     @abc.abstractmethod
     def unregister(self, name, node):
         """
@@ -186,13 +208,23 @@ class Backend(object):
         pass
 
     @abc.abstractmethod
-    def watches(self, name=None, timeout=None, recursive=True):
+    def snapshot(self, name=None):
+        """
+
+        :param name:
+        :return: a tuple of backend index and ProxyEvents of all available nodes.
+        """
+        pass
+
+    @abc.abstractmethod
+    def watches(self, name=None, timeout=None, recursive=True, index=None):
         """
 
         :param name:
         :param timeout:
         :param recursive:
-        :return:
+        :param index: backend index to watch from, resume after the last seen index if not set.
+        :return: a generator of ProxyEvents, events without name ask the consumer to resync.
         """
         pass
 
@@ -212,6 +244,18 @@ class EtcdBackend(Backend):
 
         self._client = etcd.Client(host=host_tuple, allow_reconnect=True)
         self._logger = loggers.getlogger('p.b.EtcdBackend')
+        self._index = 0
+
+    @property
+    def index(self):
+        """
+        last etcd index seen by snapshot or watches.
+        """
+        return self._index
+
+    def _seen_index(self, index):
+        if index and index > self._index:
+            self._index = index
 
     def _etcdkey(self, name, uuid=None, with_nodes_key=True):
 
@@ -242,7 +286,7 @@ class EtcdBackend(Backend):
         return json.dumps(raw_value.to_dict(), sort_keys=True)
 
     def _rawvalue(self, etcd_value):
-        return ProxyNode.from_dict(json.loads(etcd_value))
+        return ProxyNode.from_json(etcd_value)
 
     def register(self, name, node, ttl=None):
 
@@ -257,6 +301,21 @@ class EtcdBackend(Backend):
             self._logger.ex('register occur error.')
             raise BackendError
 
+    def refresh(self, name, node, ttl):
+
+        self._check_name(name)
+        self._check_node(node)
+
+        etcd_key = self._etcdkey(name, uuid=node.uuid)
+        try:
+            self._client.refresh(etcd_key, ttl=ttl)
+        except etcd.EtcdKeyNotFound:
+            self._logger.w('refresh key %s not found, register it again.', etcd_key)
+            self.register(name, node, ttl=ttl)
+        except:
+            self._logger.ex('refresh occur error.')
+            raise BackendError
+
     def _check_name(self, name):
         if not name:
             raise BackendValueError('name must not be none or empty.')
@@ -318,6 +377,28 @@ class EtcdBackend(Backend):
             self._logger.ex('lookall key %s occurs error.', etcd_key)
             raise BackendError
 
+    def snapshot(self, name=None):
+
+        etcd_key = self._etcdkey(name, with_nodes_key=False) if name else self._path
+        try:
+
+            etcd_result = self._client.read(etcd_key, recursive=True)
+            proxy_events = etcd_result.leaves \
+                           | select(lambda it: it.value) \
+                           | collect(lambda it: self._to_proxyevent(it)) \
+                           | select(lambda it: it.node) \
+                           | as_list
+            self._seen_index(etcd_result.etcd_index)
+            return etcd_result.etcd_index, proxy_events
+        except etcd.EtcdKeyError as e:
+            self._logger.w('key %s not found, just ignore it.', etcd_key)
+            etcd_index = (e.payload or {}).get('index')
+            self._seen_index(etcd_index)
+            return etcd_index, []
+        except:
+            self._logger.ex('snapshot key %s occurs error.', etcd_key)
+            raise BackendError
+
     def _isavailable_proxynode(self, node):
 
         if not node.network:
@@ -334,6 +415,7 @@ class EtcdBackend(Backend):
             self._collect_proxydetails(child, results)
 
         return results.items() \
+               | sort(key=lambda it: it[0]) \
                | collect(lambda it: ProxyDetail(it[0], nodes=it[1])) \
                | as_list
 
@@ -353,15 +435,45 @@ class EtcdBackend(Backend):
         else:
             results[name] = [node]
 
-    def watches(self, name=None, timeout=None, recursive=True):
+    def _to_proxyevent(self, result):
 
-        etcd_key = self._etcdkey(name, with_nodes_key=False) if name else self._path
-        etcd_results = self._client.eternal_watch(etcd_key, recursive=recursive)
+        if result.dir:
+            return ProxyEvent(result.action, None, None, None, result.modifiedIndex)
+
+        name = self._rawkey(result.key)
+        uuid = result.key | split(r'/') | reverse | first
+        node = self._rawvalue(result.value) if result.value else None
+
+        if node and not self._isavailable_proxynode(node):
+            node = None
+
+        return ProxyEvent(result.action, name, uuid, node, result.modifiedIndex)
 
-        for etcd_result in etcd_results:
+    def watches(self, name=None, timeout=None, recursive=True, index=None):
+
+        etcd_key = self._etcdkey(name, with_nodes_key=False) if name else self._path
+        if index:
+            self._index = index - 1
+
+        while True:
+            # resume right after the last seen index, also across reconnects.
+            try:
+                etcd_result = self._client.watch(etcd_key,
+                                                 index=self._index + 1 if self._index else None,
+                                                 timeout=0,
+                                                 recursive=recursive)
+            except etcd.EtcdEventIndexCleared as e:
+                # events after our index are gone, consumers resync with a snapshot.
+                etcd_index = (e.payload or {}).get('index')
+                self._logger.w('watch index %s cleared at %s, resync from snapshot.', self._index + 1, etcd_index)
+                yield ProxyEvent('resync', None, None, None, etcd_index)
+                self._seen_index(etcd_index)
+                continue
+
+            self._seen_index(etcd_result.modifiedIndex)
             if etcd_result.action not in ['set']:
-                yield self._to_proxydetails(etcd_result)
+                yield self._to_proxyevent(etcd_result)
             elif not hasattr(etcd_result, '_prev_node'):
-                yield self._to_proxydetails(etcd_result)
+                yield self._to_proxyevent(etcd_result)
             elif not etcd_result.value == etcd_result._prev_node.value:
-                yield self._to_proxydetails(etcd_result)
+                yield self._to_proxyevent(etcd_result)
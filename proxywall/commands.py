@@ -7,6 +7,7 @@ import pipes
 import select as ioselect
 import shlex
 import subprocess
+import time
 
 from proxywall import loggers
 from proxywall.commons import *
@@ -14,7 +15,7 @@ from proxywall.commons import *
 _logger = loggers.getlogger('p.commands')
 
 
-def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, binary_data=False):
+def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, binary_data=False, timeout=None):
     """
 
     :param cmd:
@@ -23,6 +24,7 @@ def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, bi
     :param use_shell:
     :param data:
     :param binary_data:
+    :param timeout: seconds to wait before kill the command, optional.
     :return:
     """
 
@@ -58,6 +60,7 @@ def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, bi
     try:
 
         cmd_proc = subprocess.Popen(cmd_args, **kwargs)
+        cmd_deadline = time.time() + timeout if timeout else None
 
         std_out = ''
         std_err = ''
@@ -71,6 +74,12 @@ def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, bi
 
         while True:
 
+            if cmd_deadline and time.time() > cmd_deadline and cmd_proc.poll() is None:
+                _logger.w('''run command['%s'] timeout after %s seconds, kill it.''', cmd, timeout)
+                cmd_proc.kill()
+                cmd_proc.wait()
+                break
+
             rfd, wfd, efd = ioselect.select(rpipes, [], rpipes, 1)
             if cmd_proc.stdout in rfd:
                 dat = os.read(cmd_proc.stdout.fileno(), 2048)
@@ -92,6 +101,9 @@ def run(cmd, close_fds=True, use_executable=None, use_shell=False, data=None, bi
             # Only then it is safe to wait for the process to be finished
             # NOTE: Actually cmd.poll() is always None here if rpipes is empty
             elif not rpipes and cmd_proc.poll() == None:
+                # keep polling until the deadline, select just sleeps without pipes.
+                if cmd_deadline:
+                    continue
                 cmd_proc.wait()
                 # The process is terminated. Since no pipes to read from are
                 # left, there is no need to run select() again.
@@ -21,14 +21,29 @@ class _Constants(object):
 
 _constants = _Constants()
 _constants.ADDR_ENV = 'PROXYWALL_ADDR'
+_constants.WORKERS_ENV = 'PROXYWALL_WORKERS'
+_constants.WORKER_FD_ENV = 'PROXYWALL_WORKER_FD'
 _constants.BACKEND_ENV = 'PROXYWALL_BACKEND'
 _constants.NETWORKS_ENV = 'PROXYWALL_NETWORKS'
 _constants.HTTP_PORT_ENV = 'PROXYWALL_HTTP_PORT'
 _constants.HTTPS_PORT_ENV = 'PROXYWALL_HTTPS_PORT'
 _constants.TEMPLATE_SRC_ENV = 'PROXYWALL_TEMPLATE_SRC'
 _constants.TEMPLATE_DEST_ENV = 'PROXYWALL_TEMPLATE_DEST'
+_constants.TEMPLATE_CACHE_ENV = 'PROXYWALL_TEMPLATE_CACHE'
+_constants.FRAGMENT_TEMPLATE_SRC_ENV = 'PROXYWALL_FRAGMENT_TEMPLATE_SRC'
+_constants.FRAGMENT_DEST_ENV = 'PROXYWALL_FRAGMENT_DEST'
+_constants.HAPROXY_SOCKET_ENV = 'PROXYWALL_HAPROXY_SOCKET'
+_constants.HAPROXY_SLOTS_ENV = 'PROXYWALL_HAPROXY_SLOTS'
+_constants.RELOAD_INTERVAL_ENV = 'PROXYWALL_RELOAD_INTERVAL'
+_constants.CMD_TIMEOUT_ENV = 'PROXYWALL_CMD_TIMEOUT'
+_constants.RELOAD_PIDFILE_ENV = 'PROXYWALL_RELOAD_PIDFILE'
+_constants.RELOAD_SIGNAL_ENV = 'PROXYWALL_RELOAD_SIGNAL'
+_constants.RELOAD_CONFIRM_ENV = 'PROXYWALL_RELOAD_CONFIRM'
+_constants.TARGETS_ENV = 'PROXYWALL_TARGETS'
 _constants.PREV_CMD_ENV = 'PROXYWALL_PREV_CMD'
 _constants.POST_CMD_ENV = 'PROXYWALL_POST_CMD'
+_constants.DEBOUNCE_ENV = 'PROXYWALL_DEBOUNCE'
+_constants.DEBOUNCE_MAX_ENV = 'PROXYWALL_DEBOUNCE_MAX'
 
 _constants.DOCKER_URL_ENV = 'PROXYWALL_DOCKER_URL'
 _constants.DOCKER_TLSCA_ENV = 'PROXYWALL_DOCKER_TLSCA'
@@ -36,8 +51,18 @@ _constants.DOCKER_TLSKEY_ENV = 'PROXYWALL_DOCKER_TLSKEY'
 _constants.DOCKER_TLSCERT_ENV = 'PROXYWALL_DOCKER_TLSCERT'
 _constants.DOCKER_TLSVERIFY_ENV = 'PROXYWALL_DOCKER_TLSVERIFY'
 
+_constants.DISCOVERY_ENV = 'PROXYWALL_DISCOVERY'
+_constants.HEARTBEAT_WORKERS_ENV = 'PROXYWALL_HEARTBEAT_WORKERS'
+_constants.HEARTBEAT_INTERVAL_ENV = 'PROXYWALL_HEARTBEAT_INTERVAL'
+_constants.HEARTBEAT_TTL_ENV = 'PROXYWALL_HEARTBEAT_TTL'
+_constants.HEARTBEAT_JITTER_ENV = 'PROXYWALL_HEARTBEAT_JITTER'
+_constants.HEARTBEAT_RATE_ENV = 'PROXYWALL_HEARTBEAT_RATE'
+
 _constants.REDIRECT_RULES = 'PROXYWALL_REDIRECT_RULES'
 _constants.DEFAULT_REDIRECT_URL = 'PROXYWALL_DEFAULT_REDIRECT_URL'
+_constants.REDIRECT_CACHE_SIZE = 'PROXYWALL_REDIRECT_CACHE_SIZE'
+_constants.REDIRECT_CODE = 'PROXYWALL_REDIRECT_CODE'
+_constants.REDIRECT_MAX_AGE = 'PROXYWALL_REDIRECT_MAX_AGE'
 
 _constants.FORWARD_HOST = 'PROXYWALL_FORWARD_HOST'
 _constants.FORWARD_PORT = 'PROXYWALL_FORWARD_PORT'
@@ -8,8 +8,10 @@ import urlparse
 from proxywall import constants
 from proxywall import loggers
 from proxywall import monitors
+from proxywall import reloads
 from proxywall.backend import *
 from proxywall.commons import *
+from proxywall.targets import *
 from proxywall.version import current_version
 
 __BACKEND_TYPES = {"etcd": EtcdBackend}
@@ -35,32 +37,119 @@ def _get_callargs():
     parser.add_argument('-template-dest', dest='template_dest', default=os.getenv(constants.TEMPLATE_DEST_ENV),
                         help='out template file location.')
 
+    parser.add_argument('-targets', dest='targets', default=os.getenv(constants.TARGETS_ENV),
+                        help='json file of more templates to render, each with its own commands, optional.')
+
+    parser.add_argument('-template-cache', dest='template_cache', default=os.getenv(constants.TEMPLATE_CACHE_ENV),
+                        help='directory to cache compiled templates across restarts, optional.')
+
+    parser.add_argument('-fragment-template-src', dest='fragment_src',
+                        default=os.getenv(constants.FRAGMENT_TEMPLATE_SRC_ENV),
+                        help='jinja2 template to render each domain into its own file, optional.')
+    parser.add_argument('-fragment-dest', dest='fragment_dest', default=os.getenv(constants.FRAGMENT_DEST_ENV),
+                        help='directory of the per domain files.')
+
+    parser.add_argument('-haproxy-socket', dest='haproxy_socket', default=os.getenv(constants.HAPROXY_SOCKET_ENV),
+                        help='haproxy stats socket to update servers without reload, optional.')
+    parser.add_argument('-haproxy-slots', dest='haproxy_slots', type=int,
+                        default=os.getenv(constants.HAPROXY_SLOTS_ENV, 10),
+                        help='servers to allocate per haproxy backend, default is 10.')
+
     parser.add_argument('-prev-cmd', dest='prev_cmd', default=os.getenv(constants.PREV_CMD_ENV),
-                        help='command to run before generate template.')
+                        help='command to run before write a changed template.')
     parser.add_argument('-post-cmd', dest='post_cmd', default=os.getenv(constants.POST_CMD_ENV),
-                        help='command to run after generate template.')
+                        help='command to run after write a changed template.')
+
+    parser.add_argument('-reload-pidfile', dest='reload_pidfile', default=os.getenv(constants.RELOAD_PIDFILE_ENV),
+                        help='reload by send a signal to the pid in this file instead of run post command, optional.')
+    parser.add_argument('-reload-signal', dest='reload_signal', default=os.getenv(constants.RELOAD_SIGNAL_ENV, 'HUP'),
+                        help='signal to send to the pid in reload pidfile, default is HUP.')
+    parser.add_argument('-reload-confirm', dest='reload_confirm', type=float,
+                        default=os.getenv(constants.RELOAD_CONFIRM_ENV, 0),
+                        help='seconds to wait for the pidfile or workers to change after signal, default is 0.')
+
+    parser.add_argument('-debounce', dest='debounce', type=float, default=os.getenv(constants.DEBOUNCE_ENV, 1),
+                        help='seconds without changes to wait before generate template, default is 1.')
+    parser.add_argument('-debounce-max', dest='debounce_max', type=float,
+                        default=os.getenv(constants.DEBOUNCE_MAX_ENV, 10),
+                        help='max seconds to delay generate template after a change, default is 10.')
+    parser.add_argument('-reload-interval', dest='reload_interval', type=float,
+                        default=os.getenv(constants.RELOAD_INTERVAL_ENV, 5),
+                        help='min seconds between two generates of template, default is 5.')
+    parser.add_argument('-cmd-timeout', dest='cmd_timeout', type=float,
+                        default=os.getenv(constants.CMD_TIMEOUT_ENV, 60),
+                        help='seconds to wait for prev and post command before kill it, default is 60.')
 
     return parser.parse_args()
 
 
+def _get_targets(callargs):
+    # options not set in targets file fall back to the ones of the daemon.
+    target_defaults = {'template_cache': callargs.template_cache,
+                       'haproxy_slots': callargs.haproxy_slots,
+                       'reload_signal': callargs.reload_signal,
+                       'reload_confirm': callargs.reload_confirm,
+                       'reload_interval': callargs.reload_interval,
+                       'cmd_timeout': callargs.cmd_timeout}
+
+    proxy_targets = []
+    if callargs.template_src:
+        proxy_targets.append(ProxyTarget.from_dict({'template_src': callargs.template_src,
+                                                    'template_dest': callargs.template_dest,
+                                                    'fragment_src': callargs.fragment_src,
+                                                    'fragment_dest': callargs.fragment_dest,
+                                                    'haproxy_socket': callargs.haproxy_socket,
+                                                    'prev_cmd': callargs.prev_cmd,
+                                                    'post_cmd': callargs.post_cmd,
+                                                    'reload_pidfile': callargs.reload_pidfile},
+                                                   defaults=target_defaults))
+
+    if callargs.targets:
+        proxy_targets.extend(load_targets(callargs.targets, defaults=target_defaults))
+
+    # the target of the options must not share a dest with the ones of the targets file either.
+    check_targets(proxy_targets)
+    return proxy_targets
+
+
 def main():
     callargs = _get_callargs()
 
-    if not callargs.template_src:
-        _logger.e('%s env not set, use -template-src instead, program exit.', constants.TEMPLATE_SRC_ENV)
+    if not callargs.template_src and not callargs.targets:
+        _logger.e('%s env not set, use -template-src or -targets instead, program exit.',
+                  constants.TEMPLATE_SRC_ENV)
         sys.exit(1)
 
-    if not os.path.isfile(callargs.template_src):
-        _logger.e('%s is not a file, daemon exit.', callargs.template_src)
+    if callargs.targets and not os.path.isfile(callargs.targets):
+        _logger.e('%s is not a file, daemon exit.', callargs.targets)
         sys.exit(1)
 
-    if not callargs.template_dest:
-        _logger.e('%s env not set, use -template-dest instead, program exit.', constants.TEMPLATE_DEST_ENV)
-        sys.exit(1)
+    # the target of the options, targets file may add more.
+    if callargs.template_src:
+        if not os.path.isfile(callargs.template_src):
+            _logger.e('%s is not a file, daemon exit.', callargs.template_src)
+            sys.exit(1)
 
-    if not callargs.post_cmd:
-        _logger.e('%s env not set, use -post-cmd instead, program exit.', constants.POST_CMD_ENV)
-        sys.exit(1)
+        if not callargs.template_dest:
+            _logger.e('%s env not set, use -template-dest instead, program exit.', constants.TEMPLATE_DEST_ENV)
+            sys.exit(1)
+
+        if callargs.fragment_src and not os.path.isfile(callargs.fragment_src):
+            _logger.e('%s is not a file, daemon exit.', callargs.fragment_src)
+            sys.exit(1)
+
+        if callargs.fragment_src and not callargs.fragment_dest:
+            _logger.e('%s env not set, use -fragment-dest instead, program exit.', constants.FRAGMENT_DEST_ENV)
+            sys.exit(1)
+
+        if not callargs.post_cmd and not callargs.reload_pidfile:
+            _logger.e('%s env not set, use -post-cmd or -reload-pidfile instead, program exit.',
+                      constants.POST_CMD_ENV)
+            sys.exit(1)
+
+        if callargs.reload_pidfile and not reloads.signum(callargs.reload_signal):
+            _logger.e('signal %s not found, program exit.', callargs.reload_signal)
+            sys.exit(1)
 
     networks = callargs.networks | split('[,;\s]') if callargs.networks else callargs.networks
     if not networks:
@@ -78,14 +167,19 @@ def main():
         _logger.e('backend[type=%s] not found, program exit.', backend_type)
         sys.exit(1)
 
+    try:
+        proxy_targets = _get_targets(callargs)
+    except (IOError, ValueError):
+        _logger.ex('load targets occurs error, program exit.')
+        sys.exit(1)
+
     backend = backend_cls(backend_url, networks=networks)
     monitors.loop(backend,
+                  proxy_targets,
                   http_port=callargs.http_port,
                   https_port=callargs.https_port,
-                  prev_cmd=callargs.prev_cmd,
-                  post_cmd=callargs.post_cmd,
-                  template_src=callargs.template_src,
-                  template_dest=callargs.template_dest)
+                  debounce=callargs.debounce,
+                  debounce_max=callargs.debounce_max)
 
 
 if __name__ == '__main__':
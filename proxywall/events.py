@@ -1,12 +1,15 @@
 """
 
 """
+import random
 import sched
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 import docker
-import jsonselect
 
+from proxywall import accessors
 from proxywall import loggers
 from proxywall import supervisor
 from proxywall.backend import *
@@ -15,92 +18,233 @@ from proxywall.errors import *
 
 _logger = loggers.getlogger('p.e.Loop')
 
+_REGISTER_ACTIONS = ['start', 'unpause', 'health_status: healthy']
+_UNREGISTER_ACTIONS = ['die', 'stop', 'destroy', 'health_status: unhealthy']
 
-def loop(backend, docker_url):
+# docker labels which are equivalent to the proxy environments.
+_PROXY_LABELS = {'proxywall.vhost': 'VHOST', 'proxywall.vport': 'VPORT',
+                 'proxywall.vaddr': 'VADDR', 'proxywall.vnetwork': 'VNETWORK',
+                 'proxywall.vproto': 'VPROTO', 'proxywall.vredirect': 'VREDIRECT',
+                 'proxywall.vweight': 'VWEIGHT'}
+
+DISCOVERY_ENV = 'env'
+DISCOVERY_LABEL = 'label'
+
+
+class _Heartbeat(object):
+    """
+    heartbeat schedule of an agent, staggered by a random phase and jitter and
+    capped to a number of backend writes per second.
+    """
+
+    def __init__(self, interval=30, ttl=60, jitter=0, rate=None, workers=8):
+        self._interval = interval
+        self._ttl = ttl
+        self._jitter = jitter if jitter else 0
+        self._rate = rate
+        self._next_at = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(workers)
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def max_sweep_seconds(self):
+        # the last node of a sweep must be refreshed before its ttl since the previous sweep ends.
+        return self._ttl - self._interval - self._jitter
+
+    @property
+    def capacity(self):
+        """
+        backend writes a sweep may take at rate before nodes expire, None if unlimited.
+        """
+        return int(self._rate * self.max_sweep_seconds) if self._rate else None
+
+    def first_delay(self):
+        # a random phase, so agents restarted together do not stay in step.
+        return random.uniform(0, self._interval)
+
+    def next_delay(self):
+        delay = self._interval + random.uniform(-self._jitter, self._jitter)
+        return delay if delay > 1 else 1
+
+    def throttle(self):
+        if not self._rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._next_at = self._next_at if self._next_at > now else now
+            delay = self._next_at - now
+            self._next_at += 1.0 / self._rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def loop(backend, docker_url, workers=None, discovery=None,
+         interval=None, ttl=None, jitter=None, rate=None):
     """
 
     :param backend:
     :param docker_url:
+    :param workers: how many containers to inspect and register concurrently.
+    :param discovery: env inspects every container and reads its environments and labels,
+                      label only lists containers labeled with proxywall.vhost and never inspects.
+    :param interval: seconds between two heartbeat sweeps.
+    :param ttl: seconds a registered node lives without heartbeat.
+    :param jitter: max random seconds added to or removed from each interval.
+    :param rate: max backend writes per second of a sweep, unlimited if not set.
     :return:
     """
 
     _logger.w('start and supervise event loop.')
 
     client = docker.AutoVersionClient(base_url=docker_url)
-    supervisor.supervise(min_seconds=2, max_seconds=64)(_event_loop)(backend, client)
 
+    # container id -> (domain, node) registered by this agent.
+    registry = {}
+    # container id -> (status, (domain, node) or None) derived from the last inspect.
+    cache = {}
+    heartbeat = _Heartbeat(interval=interval or 30, ttl=ttl or 60, jitter=jitter,
+                           rate=rate, workers=workers or 8)
+
+    # in label discovery, docker filters out unlabeled containers for us.
+    filters = {'label': 'proxywall.vhost'} if discovery == DISCOVERY_LABEL else None
+
+    heartbeat_thread = threading.Thread(
+        target=supervisor.supervise(min_seconds=2, max_seconds=64)(_heartbeat_loop),
+        args=(backend, client, registry, cache, heartbeat, filters),
+        name='heartbeat')
+    heartbeat_thread.setDaemon(True)
+    heartbeat_thread.start()
+
+    supervisor.supervise(min_seconds=2, max_seconds=64)(_event_loop)(backend, client, registry, cache, heartbeat,
+                                                                      filters)
+
+
+def _event_loop(backend, client, registry, cache, heartbeat, filters):
+    # subscribe first, so nothing happens between the sweep and the stream.
+    events = client.events(decode=True, filters=filters)
+
+    # events may be lost while (re)connecting, inspect everything again.
+    cache.clear()
+    _heartbeat_containers(backend, client, registry, cache, heartbeat, filters)
+
+    for event in events:
+        _handle_event(backend, client, registry, cache, heartbeat, filters, event)
+
+    # dockerd closes the stream when it restarts, let the supervisor subscribe again.
+    raise IOError('docker closed the events stream.')
 
-def _event_loop(backend, client):
-    _heartbeat_containers(backend, client)
+
+def _heartbeat_loop(backend, client, registry, cache, heartbeat, filters):
+    # events keep the backend current, the sweep only reconciles and refreshes ttl.
+    time.sleep(heartbeat.first_delay())
 
     _schd = sched.scheduler(time.time, time.sleep)
     while True:
-        _schd.enter(30, 0, _heartbeat_containers, (backend, client))
+        _schd.enter(heartbeat.next_delay(), 0, _heartbeat_containers,
+                    (backend, client, registry, cache, heartbeat, filters))
         _schd.run()
 
 
-def _heartbeat_containers(backend, client):
-    # list all running containers.
-    containers = client.containers(quiet=True) \
-                 | collect(lambda it: _jsonselect(it, '.Id')) \
-                 | collect(lambda it: client.inspect_container(it))
-    for container in containers:
-        _heartbeat_container(backend, container)
+def _handle_event(backend, client, registry, cache, heartbeat, filters, event):
+    if event.get('Type', 'container') != 'container':
+        return
 
+    container_id = event.get('id')
+    container_action = event.get('status') or event.get('Action')
+    if not container_id:
+        return
 
-def _heartbeat_container(backend, container):
-    try:
+    if container_action in _REGISTER_ACTIONS:
+        _logger.d('container[id=%s] %s, register it.', container_id, container_action)
+        cache.pop(container_id, None)
+        _heartbeat_container(backend, client, registry, cache, heartbeat, filters, {'Id': container_id})
 
-        container_id = _jsonselect(container, '.Id')
-        container_status = _jsonselect(container, '.State .Status')
+    elif container_action in _UNREGISTER_ACTIONS:
+        _logger.d('container[id=%s] %s, unregister it.', container_id, container_action)
+        cache.pop(container_id, None)
+        _unregister_container(backend, registry, container_id)
 
-        # ignore tty container.
-        is_tty_container = _jsonselect(container, '.Config .Tty')
-        if is_tty_container:
-            _logger.w('ignore tty container[id=%s, status=%s]', container_id, container_status)
-            return
 
-        container_environments = _jsonselect(container, '.Config .Env')
-        if not container_environments:
-            return
+def _heartbeat_containers(backend, client, registry, cache, heartbeat, filters):
+    # list all running containers, State is only reported since docker api 1.23.
+    containers = client.containers(filters=filters) \
+                 | collect(lambda it: (it.get('Id'), it)) \
+                 | as_dict
 
-        container_environments = container_environments \
-                                 | collect(lambda it: it | split(r'=', maxsplit=1)) \
-                                 | collect(lambda it: it | as_tuple) \
-                                 | as_tuple \
-                                 | as_dict
+    # evict and unregister containers which gone away without any event.
+    vanished_ids = cache.keys() | select(lambda it: it not in containers) | as_list
+    for container_id in vanished_ids:
+        cache.pop(container_id, None)
 
-        proxy_domain = _jsonselect(container_environments, '.VHOST')
-        proxy_port = _jsonselect(container_environments, '.VPORT')
+    vanished_ids = registry.keys() | select(lambda it: it not in containers) | as_list
+    for container_id in vanished_ids:
+        _unregister_container(backend, registry, container_id)
 
-        if not proxy_domain or not proxy_port:
+    capacity = heartbeat.capacity
+    if capacity is not None and len(containers) > capacity:
+        _logger.e('%s containers exceed the %s backend writes heartbeat rate allows within ttl, '
+                  'nodes will expire, raise heartbeat rate or ttl.', len(containers), capacity)
+
+    # fan out inspects and registrations, the first BackendError aborts the sweep.
+    aborted = threading.Event()
+
+    def _heartbeat(container):
+        if aborted.is_set():
             return
+        try:
+            _heartbeat_container(backend, client, registry, cache, heartbeat, filters, container, throttle=True)
+        except BackendError:
+            aborted.set()
+            raise
+
+    started_at = time.time()
+    for _ in heartbeat.pool.imap_unordered(_heartbeat, containers.values()):
+        pass
+
+    sweep_seconds = time.time() - started_at
+    if sweep_seconds > heartbeat.max_sweep_seconds:
+        _logger.w('heartbeat of %s containers took %.1f seconds, nodes may expire before the next one.',
+                  len(containers), sweep_seconds)
 
-        proxy_addr = _jsonselect(container_environments, '.VADDR')
-        proxy_network = _jsonselect(container_environments, '.VNETWORK')
 
-        # it may be occurs error when proxy_network is a malicious word.
-        if proxy_network:
-            proxy_addr_selector = \
-                '.NetworkSettings .Networks .{} .IPAddress'.format(proxy_network)
-            proxy_addr = _jsonselect(container, proxy_addr_selector)
+def _heartbeat_container(backend, client, registry, cache, heartbeat, filters, container, throttle=False):
+    container_id = container.get('Id')
+    try:
 
-        if not proxy_addr:
-            _logger.w('''ignore tty container[id=%s, vhost=%s] because addrs not found.''',
-                      container_id,
-                      proxy_domain)
+        proxy_entry = _cached_proxy_entry(client, cache, filters, container)
+        if not proxy_entry:
+            _unregister_container(backend, registry, container_id)
             return
 
-        proxy_proto = _jsonselect(container_environments, '.VPROTO')
-        proxy_redirect = _jsonselect(container_environments, '.VREDIRECT')
-        proxy_weight = _jsonselect(container_environments, '.VWEIGHT')
+        proxy_domain, proxy_node = proxy_entry
+        registered_entry = registry.get(container_id)
 
-        _logger.d('heartbeat container[id=%s, vhost=%s] to backend.', container_id, proxy_domain)
-        proxy_node = ProxyNode(uuid=container_id, addr=proxy_addr, port=proxy_port,
-                               proto=proxy_proto, redirect=proxy_redirect, network=proxy_network,
-                               weight=proxy_weight)
+        # only rewrite the value when it changed, otherwise just extend its ttl.
+        if _is_same_entry(registered_entry, proxy_entry):
+            _logger.d('refresh container[id=%s, vhost=%s] in backend.', container_id, proxy_domain)
+            if throttle:
+                heartbeat.throttle()
+            backend.refresh(proxy_domain, proxy_node, ttl=heartbeat.ttl)
+            return
 
-        backend.register(proxy_domain, proxy_node, ttl=60)
+        if registered_entry and registered_entry[0] != proxy_domain:
+            _unregister_container(backend, registry, container_id)
+
+        _logger.d('heartbeat container[id=%s, vhost=%s] to backend.', container_id, proxy_domain)
+        if throttle:
+            heartbeat.throttle()
+        backend.register(proxy_domain, proxy_node, ttl=heartbeat.ttl)
+        registry[container_id] = proxy_entry
 
     except BackendValueError:
         _logger.ex('heartbeat container occurs BackendValueError, just ignore it.')
@@ -110,5 +254,120 @@ def _heartbeat_container(backend, container):
         _logger.ex('heartbeat container occurs error, just ignore it.')
 
 
+def _is_same_entry(entry, other_entry):
+    if not entry or not other_entry:
+        return False
+
+    return entry[0] == other_entry[0] and entry[1].to_dict() == other_entry[1].to_dict()
+
+
+def _cached_proxy_entry(client, cache, filters, container):
+    container_id = container.get('Id')
+
+    # labels and networks of the list payload are enough in label discovery.
+    if filters:
+        if 'Labels' not in container:
+            container = client.containers(filters=dict(filters, id=container_id)) | first
+        return _proxy_entry(container) if container else None
+
+    cache_entry = cache.get(container_id)
+    if cache_entry and container.get('State') in [None, cache_entry[0]]:
+        return cache_entry[1]
+
+    container = client.inspect_container(container_id)
+    proxy_entry = _proxy_entry(container)
+    cache[container_id] = ((container.get('State') or {}).get('Status'), proxy_entry)
+    return proxy_entry
+
+
+def _unregister_container(backend, registry, container_id):
+    proxy_entry = registry.pop(container_id, None)
+    if not proxy_entry:
+        return
+
+    proxy_domain, proxy_node = proxy_entry
+    _logger.d('unregister container[id=%s, vhost=%s] from backend.', container_id, proxy_domain)
+    backend.unregister(proxy_domain, proxy_node)
+
+
+def _proxy_entry(container):
+    # paths of the docker payload are child keys, a selector would also match them deeper.
+    container_id = accessors.select_keys(container, ('Id',))
+    container_status = accessors.select_keys(container, ('State', 'Status'))
+
+    # inspects also see containers which exited since they started or were listed.
+    container_state = container.get('State')
+    if isinstance(container_state, dict):
+        is_running = container_state.get('Running', True)
+    else:
+        is_running = container_state in [None, 'running']
+    if not is_running:
+        _logger.w('ignore not running container[id=%s, status=%s]', container_id, container_status)
+        return None
+
+    # ignore tty container.
+    is_tty_container = accessors.select_keys(container, ('Config', 'Tty'))
+    if is_tty_container:
+        _logger.w('ignore tty container[id=%s, status=%s]', container_id, container_status)
+        return None
+
+    # ignore container which failed its healthcheck, list payload only reports it in Status.
+    container_health = accessors.select_keys(container, ('State', 'Health', 'Status'))
+    if container_health == 'unhealthy' or '(unhealthy)' in (container.get('Status') or ''):
+        _logger.w('ignore unhealthy container[id=%s, status=%s]', container_id, container_status)
+        return None
+
+    container_environments = _container_environments(container)
+    if not container_environments:
+        return None
+
+    proxy_domain = _jsonselect(container_environments, '.VHOST')
+    proxy_port = _jsonselect(container_environments, '.VPORT')
+
+    if not proxy_domain or not proxy_port:
+        return None
+
+    proxy_addr = _jsonselect(container_environments, '.VADDR')
+    proxy_network = _jsonselect(container_environments, '.VNETWORK')
+
+    # look up by keys, proxy_network may be a malicious word as a selector.
+    if proxy_network:
+        proxy_addr_keys = ('NetworkSettings', 'Networks', proxy_network, 'IPAddress')
+        proxy_addr = accessors.select_keys(container, proxy_addr_keys)
+
+    if not proxy_addr:
+        _logger.w('''ignore tty container[id=%s, vhost=%s] because addrs not found.''',
+                  container_id,
+                  proxy_domain)
+        return None
+
+    proxy_proto = _jsonselect(container_environments, '.VPROTO')
+    proxy_redirect = _jsonselect(container_environments, '.VREDIRECT')
+    proxy_weight = _jsonselect(container_environments, '.VWEIGHT')
+
+    proxy_node = ProxyNode(uuid=container_id, addr=proxy_addr, port=proxy_port,
+                           proto=proxy_proto, redirect=proxy_redirect, network=proxy_network,
+                           weight=proxy_weight)
+    return proxy_domain, proxy_node
+
+
+def _container_environments(container):
+    container_config = container.get('Config') or {}
+
+    container_environments = (container_config.get('Env') or []) \
+                             | collect(lambda it: it | split(r'=', maxsplit=1)) \
+                             | collect(lambda it: it | as_tuple) \
+                             | as_tuple \
+                             | as_dict
+
+    # labels of inspect payload live in Config, labels of list payload in the top level.
+    container_labels = container_config.get('Labels') or container.get('Labels') or {}
+    for label, label_value in container_labels.items():
+        if label in _PROXY_LABELS:
+            container_environments[_PROXY_LABELS[label]] = label_value
+
+    return container_environments
+
+
 def _jsonselect(obj, selector):
-    return jsonselect.select(selector, obj)
+    return accessors.select(obj, selector)
@@ -2,12 +2,12 @@ import argparse
 import os
 import sys
 
-from twisted.internet import reactor
 from twisted.web import server
 from twisted.web.proxy import ReverseProxyResource
 
 from proxywall import constants
 from proxywall import loggers
+from proxywall import workers
 from proxywall.commons import *
 from proxywall.version import current_version
 
@@ -30,6 +30,10 @@ def _get_callargs():
     parser.add_argument('--addr', dest='addr',
                         default=os.getenv(constants.ADDR_ENV, '0.0.0.0:8888'))
 
+    parser.add_argument('--workers', dest='workers', type=int,
+                        default=os.getenv(constants.WORKERS_ENV, 1),
+                        help='processes to serve with on one socket, default is 1.')
+
     return parser.parse_args()
 
 
@@ -49,12 +53,13 @@ def main():
     forward_port = callargs.forward_port
     forward_path = callargs.forward_path
 
-    forward_dispatcher = ReverseProxyResource(forward_host, forward_port, forward_path)
     listen_port, listen_host = listen_addr[1] | as_int, listen_addr[0]
-    reactor.listenTCP(listen_port, server.Site(forward_dispatcher), interface=listen_host)
-
     _logger.w('waitting request on [tcp/%s].', callargs.addr)
-    reactor.run()
+    workers.serve(lambda: server.Site(ReverseProxyResource(forward_host, forward_port, forward_path)),
+                  listen_host,
+                  listen_port,
+                  workers=callargs.workers,
+                  worker_module='proxywall.forward')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+"""
+    reload free updates of haproxy servers through its runtime api.
+"""
+
+import socket
+from contextlib import closing
+
+from proxywall import loggers
+from proxywall.commons import *
+
+_logger = loggers.getlogger('p.HAProxy')
+
+# haproxy ends every reply with it in interactive mode.
+_PROMPT = '\n> '
+
+# replies of 'set server addr' which applied it, weight and state reply nothing when they did.
+_ADDR_REPLIES = ('IP changed from', 'port changed from', 'no need to change the addr', 'no need to change the port')
+
+
+class RuntimeApiError(Exception):
+    """
+
+    """
+    pass
+
+
+class RuntimeApi(object):
+    """
+    haproxy runtime api on a unix stats socket, needs 'level admin'.
+    """
+
+    def __init__(self, socket_path, timeout=5):
+        self._socket_path = socket_path
+        self._timeout = timeout
+
+    def execute(self, commands, accepted=None):
+        """
+        run commands one by one in one interactive session, so every reply is known to its command.
+
+        :param commands:
+        :param accepted: tells by (command, reply) if haproxy applied the command, optional.
+        :return: the replies of the commands.
+        :raise RuntimeApiError: at the first reply not accepted, the commands after it are not run.
+        """
+        replies = []
+        with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as s:
+            s.settimeout(self._timeout)
+            s.connect(self._socket_path)
+
+            s.sendall('prompt\n')
+            _, received = _read_reply(s, '')
+
+            for command in commands:
+                s.sendall(command + '\n')
+                reply, received = _read_reply(s, received)
+                if accepted and not accepted(command, reply):
+                    raise RuntimeApiError('{} replied {}'.format(command, reply or 'nothing'))
+                replies.append(reply)
+
+            s.sendall('quit\n')
+
+        return replies
+
+
+class SlotDriver(object):
+    """
+    keeps every node of a domain in a stable server slot of the haproxy backend named after the domain,
+    so membership, address and weight changes become runtime api updates instead of reloads.
+    """
+
+    def __init__(self, socket_path, slots=10, server_prefix='srv', timeout=5):
+        """
+
+        :param socket_path: haproxy stats socket.
+        :param slots: servers to allocate per backend.
+        :param server_prefix: slot server names are server_prefix + 1..slots, like server-template.
+        :param timeout:
+        :return:
+        """
+        self._api = RuntimeApi(socket_path, timeout=timeout)
+        self._slots = slots
+        self._server_prefix = server_prefix
+
+        # domain -> [node or None] of each slot, as haproxy runs it.
+        self._applied = None
+
+    def assign(self, proxy_details):
+        """
+        place nodes into slots, nodes keep the slot they had before.
+
+        :param proxy_details:
+        :return: domain -> [(server name, node or None)] of each slot.
+        """
+        applied = self._applied or {}
+
+        proxy_slots = {}
+        for proxy_detail in proxy_details:
+            applied_nodes = applied.get(proxy_detail.name) or []
+            slot_nodes = [None] * ([self._slots, len(applied_nodes), len(proxy_detail.nodes)] | max)
+
+            # keep nodes in their current slot, then fill free slots in order.
+            pending_nodes = []
+            applied_uuids = applied_nodes | collect(lambda it: it.uuid if it else None) | as_list
+            for node in proxy_detail.nodes:
+                if node.uuid in applied_uuids:
+                    slot_nodes[applied_uuids.index(node.uuid)] = node
+                else:
+                    pending_nodes.append(node)
+
+            for node in pending_nodes:
+                slot_nodes[slot_nodes.index(None)] = node
+
+            proxy_slots[proxy_detail.name] = [('{}{}'.format(self._server_prefix, index + 1), node)
+                                              for index, node in enumerate(slot_nodes)]
+
+        return proxy_slots
+
+    def update(self, proxy_slots):
+        """
+        apply slots through the runtime api.
+
+        :param proxy_slots: result of assign.
+        :return: False if the change is structural and needs a reload.
+        """
+        if self._applied is None or sorted(self._applied.keys()) != sorted(proxy_slots.keys()):
+            return False
+
+        commands = []
+        for name, slots in proxy_slots.items():
+            applied_nodes = self._applied[name]
+            if len(applied_nodes) != len(slots):
+                return False
+
+            for (server, node), applied_node in zip(slots, applied_nodes):
+                if node is applied_node or (node and applied_node and tuple(node) == tuple(applied_node)):
+                    continue
+
+                # the runtime api only sets addr, port and weight of a server.
+                if node and applied_node and _static_fields(node) != _static_fields(applied_node):
+                    return False
+                commands.extend(_server_commands(name, server, node))
+
+        if commands:
+            try:
+                self._api.execute(commands, accepted=_is_accepted)
+            except (socket.error, RuntimeApiError):
+                _logger.ex('update haproxy through runtime api occurs error, reload instead.')
+                return False
+
+            _logger.w('update haproxy servers through runtime api, %s commands.', len(commands))
+
+        self.reloaded(proxy_slots)
+        return True
+
+    def applied_slots(self):
+        """
+
+        :return: slots haproxy runs, like the result of assign, None before the first (re)load.
+        """
+        if self._applied is None:
+            return None
+
+        return self._applied.items() \
+               | collect(lambda it: (it[0], [('{}{}'.format(self._server_prefix, index + 1), node)
+                                             for index, node in enumerate(it[1])])) \
+               | as_dict
+
+    def reloaded(self, proxy_slots):
+        """
+        haproxy (re)loaded a config rendered from proxy_slots.
+
+        :param proxy_slots:
+        :return:
+        """
+        self._applied = proxy_slots.items() \
+                        | collect(lambda it: (it[0], it[1] | collect(lambda slot: slot[1]) | as_list)) \
+                        | as_dict
+
+
+def _server_commands(name, server, node):
+    server_key = '{}/{}'.format(name, server)
+    if not node:
+        return ['set server {} state maint'.format(server_key)]
+
+    return ['set server {} addr {} port {}'.format(server_key, node.addr, node.port),
+            'set server {} weight {}'.format(server_key, node.weight),
+            'set server {} state ready'.format(server_key)]
+
+
+def _static_fields(node):
+    return node.proto, node.redirect, node.network
+
+
+def _is_accepted(command, reply):
+    if ' addr ' in command:
+        return reply.startswith(_ADDR_REPLIES)
+    return not reply
+
+
+def _read_reply(s, received):
+    while _PROMPT not in received:
+        data = s.recv(4096)
+        if not data:
+            raise RuntimeApiError('haproxy closed the session.')
+        received += data
+
+    reply, received = received.split(_PROMPT, 1)
+    return reply.strip(), received
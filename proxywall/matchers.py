@@ -0,0 +1,281 @@
+"""
+    redirect rules compiled once, matched in one pass.
+"""
+
+import collections
+import re
+
+from proxywall import loggers
+from proxywall.commons import *
+
+__all__ = ['RedirectMatcher', 'HostRedirectMatcher']
+
+_logger = loggers.getlogger('p.Matchers')
+
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# python 2 re supports at most 100 groups in one pattern.
+_MAX_GROUPS = 99
+
+# inline flags apply to the whole pattern, named groups and backrefs break when joined.
+_UNJOINABLE_PATTERN = re.compile(r'\(\?[iLmsux]|\(\?P|\\\d')
+
+
+class RedirectMatcher(object):
+    """
+    matches paths against (pattern, redirect url) rules like re.match over the rules
+    ordered by the longest pattern first, but literal patterns are looked up by prefix
+    and the others are joined into few alternations, results are kept in a lru cache.
+    """
+
+    def __init__(self, redirect_rules, cache_size=1024):
+        """
+
+        :param redirect_rules: (pattern, redirect url) pairs.
+        :param cache_size: paths to keep the result of.
+        :return:
+        """
+        # rank of a rule is its priority, longest pattern first.
+        ranked_rules = redirect_rules \
+                       | collect(lambda it: (it[0], it[1])) \
+                       | as_set \
+                       | sort(key=lambda it: (-len(it[0]), it[0], it[1])) \
+                       | as_tuple
+
+        self._urls = ranked_rules | collect(lambda it: it[1]) | as_tuple
+        self._literals = {}
+        self._literal_lens = ()
+        self._joined_regexes = []
+        self._single_regexes = []
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+
+        regex_rules = []
+        for rank, (pattern, _) in enumerate(ranked_rules):
+            if _is_literal(pattern):
+                self._literals.setdefault(pattern, rank)
+                continue
+
+            try:
+                regex_rules.append((rank, pattern, re.compile(pattern)))
+            except re.error:
+                _logger.w('ignore redirect rule of invalid pattern %s.', pattern)
+
+        self._literal_lens = self._literals.keys() | collect(len) | as_set | sort(reverse=True) | as_tuple
+        self._joined_regexes, self._single_regexes = _join_regexes(regex_rules)
+
+    def match(self, path):
+        """
+
+        :param path:
+        :return: redirect url of the first matched rule, None if no rule matched.
+        """
+        try:
+            redirect_url = self._cache.pop(path)
+        except KeyError:
+            redirect_url = self._match(path)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+
+        self._cache[path] = redirect_url
+        return redirect_url
+
+    def _match(self, path):
+        matched_rank = None
+
+        # the longest literal prefix of path is the best literal rule.
+        for literal_len in self._literal_lens:
+            if literal_len <= len(path):
+                matched_rank = self._literals.get(path[:literal_len])
+                if matched_rank is not None:
+                    break
+
+        # joined regexes hold consecutive ranks, so the first one matched holds the best of them,
+        # the same for the regexes not joined.
+        for regexes in (self._joined_regexes, self._single_regexes):
+            for best_rank, group_ranks, regex in regexes:
+                if matched_rank is not None and best_rank > matched_rank:
+                    break
+
+                regex_match = regex.match(path)
+                if regex_match:
+                    # leftmost alternative wins, it is the best rank of this regex.
+                    regex_rank = group_ranks[regex_match.lastindex] if group_ranks else best_rank
+                    if matched_rank is None or regex_rank < matched_rank:
+                        matched_rank = regex_rank
+                    break
+
+        return self._urls[matched_rank] if matched_rank is not None else None
+
+
+class HostRedirectMatcher(object):
+    """
+    rules of a pattern like '//host/path' only apply to requests of that host, a host like
+    '*.example.com' applies to every sub domain of example.com. a request only evaluates
+    the rules of its own host, then of its wildcard hosts from the longest, then the rules without host.
+    """
+
+    def __init__(self, redirect_rules, cache_size=1024):
+        """
+
+        :param redirect_rules: (pattern, redirect url) pairs.
+        :param cache_size: paths to keep the result of, per host.
+        :return:
+        """
+        host_rules = {}
+        for pattern, redirect_url in redirect_rules:
+            host, path_pattern = _split_host(pattern)
+            host_rules.setdefault(host, []).append((path_pattern, redirect_url))
+
+        self._cache_size = cache_size
+        self._exact_matchers, self._suffix_matchers = {}, {}
+        self._default_matcher = RedirectMatcher(host_rules.pop(None, []), cache_size=cache_size)
+        for host, rules in host_rules.items():
+            self._host_matchers_of(host)[_host_key(host)] = RedirectMatcher(rules, cache_size=cache_size)
+
+        # host -> (path pattern, redirect url) rules of it.
+        self._host_rules = host_rules
+
+    def rules(self, host):
+        """
+
+        :param host: host like 'example.com' or '*.example.com'.
+        :return: (path pattern, redirect url) rules of exactly host.
+        """
+        return list(self._host_rules.get(_normalize_host(host), []))
+
+    def replace(self, host, redirect_rules):
+        """
+        a copy with the rules of host replaced, only the matcher of host is compiled again,
+        the others are shared with this matcher.
+
+        :param host: host like 'example.com' or '*.example.com'.
+        :param redirect_rules: (path pattern, redirect url) rules of host, none removes host.
+        :return:
+        """
+        host = _normalize_host(host)
+
+        host_matcher = object.__new__(HostRedirectMatcher)
+        host_matcher._cache_size = self._cache_size
+        host_matcher._default_matcher = self._default_matcher
+        host_matcher._exact_matchers = dict(self._exact_matchers)
+        host_matcher._suffix_matchers = dict(self._suffix_matchers)
+        host_matcher._host_rules = dict(self._host_rules)
+
+        if redirect_rules:
+            host_matcher._host_rules[host] = list(redirect_rules)
+            host_matcher._host_matchers_of(host)[_host_key(host)] = RedirectMatcher(redirect_rules,
+                                                                                   cache_size=self._cache_size)
+        else:
+            host_matcher._host_rules.pop(host, None)
+            host_matcher._host_matchers_of(host).pop(_host_key(host), None)
+
+        return host_matcher
+
+    def match(self, host, path):
+        """
+
+        :param host: host header of the request, may have a port.
+        :param path:
+        :return: redirect url of the first matched rule, None if no rule matched.
+        """
+        for redirect_matcher in self._host_matchers(_normalize_host(host)):
+            redirect_url = redirect_matcher.match(path)
+            if redirect_url:
+                return redirect_url
+
+        return self._default_matcher.match(path)
+
+    def _host_matchers_of(self, host):
+        return self._suffix_matchers if host.startswith('*.') else self._exact_matchers
+
+    def _host_matchers(self, host):
+        if not host:
+            return
+
+        exact_matcher = self._exact_matchers.get(host)
+        if exact_matcher:
+            yield exact_matcher
+
+        if not self._suffix_matchers:
+            return
+
+        # '.b.example.com' then '.example.com' then '.com'.
+        dot_index = host.find('.')
+        while dot_index >= 0:
+            suffix_matcher = self._suffix_matchers.get(host[dot_index:])
+            if suffix_matcher:
+                yield suffix_matcher
+            dot_index = host.find('.', dot_index + 1)
+
+
+def _split_host(pattern):
+    if not pattern.startswith('//'):
+        return None, pattern
+
+    slash_index = pattern.find('/', 2)
+    if slash_index < 0:
+        return _normalize_host(pattern[2:]), ''
+    return _normalize_host(pattern[2:slash_index]), pattern[slash_index:]
+
+
+def _host_key(host):
+    # '*.example.com' is kept as the suffix '.example.com'.
+    return host[1:] if host.startswith('*.') else host
+
+
+def _normalize_host(host):
+    if not host:
+        return host
+
+    host = host.lower()
+    port_index = host.rfind(':')
+    if port_index > host.rfind(']'):
+        host = host[:port_index]
+    return host.rstrip('.')
+
+
+def _is_literal(pattern):
+    return not (pattern | any(lambda it: it in _REGEX_CHARS))
+
+
+def _join_regexes(regex_rules):
+    # (best rank, group index -> rank of an alternative, regex) ordered by best rank,
+    # group ranks is None if not joined.
+    joined_regexes, single_regexes = [], []
+
+    joined_rules = []
+    joined_groups = 0
+    for rank, pattern, compiled in regex_rules:
+        if _UNJOINABLE_PATTERN.search(pattern):
+            single_regexes.append((rank, None, compiled))
+            continue
+
+        if joined_groups + compiled.groups + 1 > _MAX_GROUPS:
+            joined_regexes.extend(_joined_regexes(joined_rules))
+            joined_rules, joined_groups = [], 0
+
+        joined_rules.append((rank, pattern, compiled))
+        joined_groups += compiled.groups + 1
+
+    joined_regexes.extend(_joined_regexes(joined_rules))
+    return joined_regexes, single_regexes
+
+
+def _joined_regexes(joined_rules):
+    if not joined_rules:
+        return []
+
+    # each alternative is wrapped in one group, which closes last and so is the lastindex of a match.
+    group_ranks = {}
+    group_index = 1
+    for rank, _, compiled in joined_rules:
+        group_ranks[group_index] = rank
+        group_index += compiled.groups + 1
+
+    try:
+        joined_regex = re.compile(joined_rules | collect(lambda it: '({})'.format(it[1])) | join('|'))
+    except (re.error, AssertionError, OverflowError):
+        return joined_rules | collect(lambda it: (it[0], None, it[2])) | as_list
+
+    return [(joined_rules[0][0], group_ranks, joined_regex)]
@@ -2,97 +2,413 @@
 
 """
 
+import Queue
+import hashlib
 import os
+import tempfile
+import threading
+import time
 
 from proxywall import commands
 from proxywall import loggers
 from proxywall import supervisor
-from proxywall import template
+from proxywall.commons import *
+from proxywall.routes import RouteTable
 
 _logger = loggers.getlogger('p.m.Loop')
 
+# template dest -> (digest, (mtime, size)) of the last applied template.
+_applied_templates = {}
+
+# fragment dir -> {fragment dest -> (template version, nodes)} of the last applied fragments.
+_applied_fragments = {}
+
+_FRAGMENT_SUFFIX = '.conf'
+
 
 def loop(backend,
+         proxy_targets,
          http_port=None,
          https_port=None,
-         prev_cmd=None,
-         post_cmd=None,
-         template_src=None,
-         template_dest=None):
+         debounce=None,
+         debounce_max=None):
 
     """
 
     :param backend:
+    :param proxy_targets: ProxyTargets rendered from the same route table, each on its own thread.
     :param http_port:
     :param https_port:
-    :param prev_cmd:
-    :param post_cmd:
-    :param template_src:
-    :param template_dest:
+    :param debounce: seconds without changes to wait before rendering.
+    :param debounce_max: max seconds to delay rendering since the first pending change.
     :return:
     """
+    route_table = RouteTable()
+    proxy_events = Queue.Queue()
+
+    # snapshot before watching, the watches resume right after its index and miss nothing in between.
+    supervisor.supervise(min_seconds=2, max_seconds=64)(_load_proxy)(backend, route_table)
+
+    watch_thread = threading.Thread(
+        target=supervisor.supervise(min_seconds=2, max_seconds=64)(_watch_proxy),
+        args=(backend, proxy_events),
+        name='watches')
+    watch_thread.setDaemon(True)
+    watch_thread.start()
+
+    proxy_workers = []
+    for proxy_target in proxy_targets:
+        # bind proxy_target now, not when the lambda runs.
+        proxy_worker = _ProxyWorker(lambda proxy_context, proxy_target=proxy_target: _handle_proxy(proxy_target,
+                                                                                                   proxy_context,
+                                                                                                   http_port,
+                                                                                                   https_port),
+                                    min_interval=proxy_target.reload_interval)
+        worker_thread = threading.Thread(
+            target=supervisor.supervise(min_seconds=2, max_seconds=64)(proxy_worker.loop),
+            name='renders-{}'.format(proxy_target.name))
+        worker_thread.setDaemon(True)
+        worker_thread.start()
+        proxy_workers.append(proxy_worker)
+
     supervisor.supervise(min_seconds=2, max_seconds=64)(_loop_proxy)(backend,
-                                                                     http_port,
-                                                                     https_port,
-                                                                     prev_cmd,
-                                                                     post_cmd,
-                                                                     template_src,
-                                                                     template_dest)
-
-
-def _loop_proxy(backend, http_port, https_port, prev_cmd, post_cmd, template_src, template_dest):
-    # watches event first.
-    _events = backend.watches(recursive=True)
-    _handle_proxy(backend, http_port, https_port, prev_cmd, post_cmd, template_src, template_dest)
-
-    # signal
-    for _ in _events:
-        _handle_proxy(backend, http_port, https_port, prev_cmd, post_cmd, template_src, template_dest)
-
-
-def _handle_proxy(backend, http_port, https_port, prev_cmd, post_cmd, template_src, template_dest):
-    # write prev command if neccesary.
-    if prev_cmd:
-        _logger.w('run [prev_cmd=%s].', template_dest, prev_cmd)
-        commands.run(prev_cmd)
-
-    proxy_details = backend.lookall()
-    template_in = _read_src_template(template_src)
-    template_out = template.render(
-        template_in,
-        context={
-            'proxy_details': proxy_details,
-            'HTTP_PORT': http_port or 80,
-            'HTTPS_PORT': https_port or 443
-        }
-    )
-
-    _logger.w('write template to %s.', template_dest)
-    _write_dest_template(template_dest, template_out)
-
-    _logger.w('run [post_cmd=%s].', post_cmd)
-    rc, cmdout, cmderr = commands.run(post_cmd)
-    if rc != 0:
-        _logger.w('run %s with exitcode %s.', post_cmd, rc)
-
-
-def _read_src_template(template_src):
-    template_in = ''
-
-    with open(template_src, 'r') as f:
+                                                                     route_table,
+                                                                     proxy_events,
+                                                                     proxy_workers,
+                                                                     debounce or 0,
+                                                                     debounce_max or 0)
+
+
+class _ProxyWorker(object):
+    """
+    renders and reloads on its own thread, so the event loop never waits for commands.
+    at most one render is pending and it always takes the latest context submitted.
+    a render whose reload failed is tried again, backing off from min_retry to max_retry seconds.
+    """
+
+    def __init__(self, handler, min_interval=None, min_retry=2, max_retry=64):
+        self._handler = handler
+        self._min_interval = min_interval or 0
+        self._min_retry = min_retry
+        self._max_retry = max_retry
+        self._retry = 0
+        self._pending = None
+        self._handled_at = 0
+        self._cond = threading.Condition()
+
+    def submit(self, proxy_context, retry=False):
+        """
+        ask for a render, replaces one not started yet.
+
+        :param proxy_context: context of the route table, the same one for every target.
+        :param retry: only ask if no newer context is pending.
+        :return:
+        """
+        with self._cond:
+            if retry and self._pending is not None:
+                return
+            self._pending = proxy_context
+            self._cond.notify()
+
+    def loop(self):
+        """
+
+        :return:
+        """
         while True:
-            template_data = f.read(1024)
-            if not template_data:
-                break
-            template_in += template_data
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait(60)
+
+            delay = self._handled_at + ([self._min_interval, self._retry] | max) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            # changes from now on ask for the next render.
+            with self._cond:
+                proxy_context, self._pending = self._pending, None
+            self._handled_at = time.time()
+
+            try:
+                handled = self._handler(proxy_context)
+            except:
+                self.submit(proxy_context, retry=True)
+                raise
+
+            if handled is False:
+                self._retry = [self._retry * 2 or self._min_retry, self._max_retry] | min
+                _logger.w('render again in %s seconds.', self._retry)
+                self.submit(proxy_context, retry=True)
+            else:
+                self._retry = 0
+
+
+def _watch_proxy(backend, proxy_events):
+    # never blocks on rendering, watches resume right after the last seen index.
+    for proxy_event in backend.watches(recursive=True):
+        proxy_events.put(proxy_event)
+
+
+def _load_proxy(backend, route_table):
+    route_table.load(*backend.snapshot())
+
+
+def _loop_proxy(backend, route_table, proxy_events, proxy_workers, debounce, debounce_max):
+    # load the route table when stale, then keep it current from the events after the snapshot,
+    # the table survives restarts, events at or below its index are just dropped.
+    if route_table.stale:
+        _load_proxy(backend, route_table)
+    _submit_proxy(route_table, proxy_workers)
+
+    first_changed_at = None
+    last_changed_at = None
+    while True:
+        # merge changes until quiet for debounce seconds or pending for debounce_max seconds.
+        timeout = 60
+        if first_changed_at:
+            render_at = [last_changed_at + debounce, first_changed_at + (debounce_max or debounce)] | min
+            timeout = render_at - time.time()
+
+        try:
+            proxy_event = proxy_events.get(timeout=timeout) if timeout > 0 else None
+        except Queue.Empty:
+            proxy_event = None
+
+        if proxy_event is None:
+            if first_changed_at:
+                first_changed_at = last_changed_at = None
+                _submit_proxy(route_table, proxy_workers)
+            continue
+
+        if proxy_event.name is None:
+            # not a single node change or the watch index was cleared, resync the whole table.
+            # stale till loaded, a failed snapshot is loaded again when the loop restarts.
+            _logger.w('resync route table on %s event at index %s.', proxy_event.action, proxy_event.index)
+            route_table.expire()
+            _load_proxy(backend, route_table)
+        elif not route_table.apply(proxy_event):
+            continue
+
+        last_changed_at = time.time()
+        first_changed_at = first_changed_at or last_changed_at
+
+
+def _submit_proxy(route_table, proxy_workers):
+    # one context per change for every target, none renders a version the others never saw.
+    proxy_context = route_table.context()
+    for proxy_worker in proxy_workers:
+        proxy_worker.submit(proxy_context)
+
+
+def _handle_proxy(proxy_target, proxy_context, http_port, https_port):
+    template_engine, template_dest = proxy_target.template_engine, proxy_target.template_dest
+    fragment_engine, fragment_dest = proxy_target.fragment_engine, proxy_target.fragment_dest
+    haproxy_driver = proxy_target.haproxy_driver
+
+    # the shared context of the route table is never changed, targets add to a copy.
+    proxy_details = proxy_context['proxy_details']
+    template_context = dict(proxy_context, HTTP_PORT=http_port or 80, HTTPS_PORT=https_port or 443)
+
+    proxy_slots = None
+    if haproxy_driver:
+        proxy_slots = haproxy_driver.assign(proxy_details)
+        template_context['proxy_slots'] = proxy_slots
+
+    # (dest, temp, digest) of every rendered file, fragments first and the template last.
+    template_temps = []
+    try:
+
+        fragment_signatures, vanished_dests = {}, []
+        if fragment_engine:
+            fragment_dests, fragment_signatures, vanished_dests = \
+                _render_fragments(proxy_details, template_context, fragment_engine, fragment_dest, template_temps)
+            template_context['proxy_fragments'] = fragment_dests
 
-    return template_in
+        # render into a temp file next to dest, so a reload never reads a torn file.
+        template_temp, template_digest = _stream_temp_template(template_engine, template_context, template_dest)
+        template_temps.append((template_dest, template_temp, template_digest))
 
+        # most changes, e.g. of networks this daemon ignores, render the same template.
+        changed_temps = template_temps | select(lambda it: not _is_applied_template(it[0], it[2])) | as_list
+        if not changed_temps and not vanished_dests:
+            _logger.d('template %s not changed, skip write and reload.', template_dest)
+            if fragment_engine:
+                _applied_fragments[fragment_dest] = fragment_signatures
+            if haproxy_driver:
+                haproxy_driver.reloaded(proxy_slots)
+            return True
 
-def _write_dest_template(template_dest, template_out):
-    template_dir = os.path.dirname(template_dest)
+        # haproxy takes server changes without reload, only when nothing else of the config changed.
+        slots_changed = haproxy_driver and not vanished_dests and \
+                        _is_slots_change(proxy_target, template_context, changed_temps, haproxy_driver.applied_slots())
+
+        # write prev command if neccesary.
+        if proxy_target.prev_cmd:
+            _logger.w('run [prev_cmd=%s].', proxy_target.prev_cmd)
+            commands.run(proxy_target.prev_cmd, timeout=proxy_target.cmd_timeout)
+
+        # written is not applied yet, a digest of None never matches a render until the reload succeeds.
+        written_templates = []
+        for changed_dest, changed_temp, changed_digest in changed_temps:
+            _logger.w('write template to %s.', changed_dest)
+            os.rename(changed_temp, changed_dest)
+            written_templates.append((changed_dest, changed_digest, _stat_template(changed_dest)))
+            _applied_templates[changed_dest] = (None, written_templates[-1][2])
+
+        for vanished_dest in vanished_dests:
+            _logger.w('remove template %s.', vanished_dest)
+            os.remove(vanished_dest)
+            _applied_templates.pop(vanished_dest, None)
+
+        if slots_changed and haproxy_driver.update(proxy_slots):
+            _logger.w('skip reload, servers updated through haproxy runtime api.')
+        elif proxy_target.reloader.reload():
+            if haproxy_driver:
+                haproxy_driver.reloaded(proxy_slots)
+        else:
+            # the template too, a removed fragment alone would render nothing changed next time.
+            _logger.e('reload of template %s failed, apply it again on the next render.', template_dest)
+            _applied_templates[template_dest] = (None, _stat_template(template_dest))
+            return False
+
+        for written_dest, written_digest, written_stat in written_templates:
+            _applied_templates[written_dest] = (written_digest, written_stat)
+        if fragment_engine:
+            _applied_fragments[fragment_dest] = fragment_signatures
+        return True
+    finally:
+        for _, template_temp, _ in template_temps:
+            if os.path.exists(template_temp):
+                os.remove(template_temp)
+
+
+def _is_slots_change(proxy_target, template_context, changed_temps, applied_slots):
+    # render the changed files again with the slots haproxy runs, if that gives the applied files,
+    # slot servers are all that changed.
+    if applied_slots is None or sorted(applied_slots.keys()) != sorted(template_context['proxy_slots'].keys()):
+        return False
+
+    applied_context = dict(template_context, proxy_slots=applied_slots)
+    proxy_details = template_context['proxy_details'] | collect(lambda it: (it.name, it)) | as_dict
+    for changed_dest, _, _ in changed_temps:
+        applied_digest, _ = _applied_templates.get(changed_dest, (None, None))
+        if not applied_digest:
+            return False
+
+        if changed_dest == proxy_target.template_dest:
+            template_engine, changed_context = proxy_target.template_engine, applied_context
+        else:
+            proxy_detail = proxy_details.get(os.path.basename(changed_dest)[:-len(_FRAGMENT_SUFFIX)])
+            if not proxy_detail:
+                return False
+            template_engine, changed_context = proxy_target.fragment_engine, dict(applied_context,
+                                                                                  proxy_detail=proxy_detail)
+
+        if _digest_render(template_engine, changed_context) != applied_digest:
+            return False
+
+    return True
+
+
+def _render_fragments(proxy_details, template_context, fragment_engine, fragment_dest, template_temps):
+    applied_signatures = _applied_fragments.get(fragment_dest, {})
+
+    fragment_dests, fragment_signatures = [], {}
+    for proxy_detail in proxy_details:
+
+        # a name must not escape the fragment directory.
+        if '/' in proxy_detail.name or proxy_detail.name.startswith('.'):
+            _logger.w('ignore fragment of invalid name %s.', proxy_detail.name)
+            continue
+
+        proxy_dest = os.path.join(fragment_dest, proxy_detail.name + _FRAGMENT_SUFFIX)
+        fragment_dests.append(proxy_dest)
+
+        # only render domains whose nodes or fragment template changed.
+        fragment_signatures[proxy_dest] = (fragment_engine.version, proxy_detail.nodes | collect(tuple) | as_tuple)
+        if applied_signatures.get(proxy_dest) == fragment_signatures[proxy_dest]:
+            continue
+
+        proxy_context = dict(template_context, proxy_detail=proxy_detail)
+        proxy_temp, proxy_digest = _stream_temp_template(fragment_engine, proxy_context, proxy_dest)
+        template_temps.append((proxy_dest, proxy_temp, proxy_digest))
+
+    vanished_dests = []
+    if os.path.isdir(fragment_dest):
+        vanished_dests = os.listdir(fragment_dest) \
+                         | select(lambda it: it.endswith(_FRAGMENT_SUFFIX) and not it.startswith('.')) \
+                         | collect(lambda it: os.path.join(fragment_dest, it)) \
+                         | select(lambda it: it not in fragment_signatures) \
+                         | as_list
+
+    return fragment_dests, fragment_signatures, vanished_dests
+
+
+def _stream_temp_template(template_engine, template_context, template_dest):
+    template_dir = os.path.dirname(template_dest) or '.'
     if not os.path.exists(template_dir):
         os.makedirs(template_dir)
 
-    with open(template_dest, 'w') as f:
-        f.write(template_out)
+    template_fd, template_temp = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(template_dest)),
+                                                  dir=template_dir)
+    template_digest = hashlib.sha1()
+    try:
+
+        with os.fdopen(template_fd, 'wb') as f:
+            for template_data in template_engine.generate(template_context):
+                template_data = template_data.encode('utf-8')
+                template_digest.update(template_data)
+                f.write(template_data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp creates private files, keep the mode of the replaced one.
+        template_stat = _stat_template(template_dest)
+        os.chmod(template_temp, os.stat(template_dest).st_mode & 0o777 if template_stat else 0o644)
+    except:
+        os.remove(template_temp)
+        raise
+
+    return template_temp, template_digest.hexdigest()
+
+
+def _digest_render(template_engine, template_context):
+    template_digest = hashlib.sha1()
+    for template_data in template_engine.generate(template_context):
+        template_digest.update(template_data.encode('utf-8'))
+    return template_digest.hexdigest()
+
+
+def _is_applied_template(template_dest, template_digest):
+    template_stat = _stat_template(template_dest)
+    if not template_stat:
+        return False
+
+    # trust the last applied digest while nobody else touched the file.
+    applied_digest, applied_stat = _applied_templates.get(template_dest, (None, None))
+    if applied_stat != template_stat:
+        applied_digest = _digest_template(template_dest)
+        _applied_templates[template_dest] = (applied_digest, template_stat)
+
+    return applied_digest == template_digest
+
+
+def _stat_template(template_dest):
+    try:
+        template_stat = os.stat(template_dest)
+        return template_stat.st_mtime, template_stat.st_size
+    except OSError:
+        return None
+
+
+def _digest_template(template_dest):
+    template_digest = hashlib.sha1()
+
+    with open(template_dest, 'rb') as f:
+        while True:
+            template_data = f.read(65536)
+            if not template_data:
+                break
+            template_digest.update(template_data)
+
+    return template_digest.hexdigest()
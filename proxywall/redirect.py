@@ -1,19 +1,29 @@
 import argparse
 import os
-import re
 import sys
+import threading
+import urlparse
 
-from twisted.internet import reactor
 from twisted.python.compat import nativeString
 from twisted.web import server, resource
 from twisted.web.error import UnsupportedMethod
 
 from proxywall import constants
 from proxywall import loggers
+from proxywall import supervisor
+from proxywall import workers
+from proxywall.backend import *
 from proxywall.commons import *
+from proxywall.matchers import *
+from proxywall.routes import RouteTable
 from proxywall.version import current_version
 
 __ADDRPAIR_LEN = 2
+__BACKEND_TYPES = {"etcd": EtcdBackend}
+
+# older twisted knows no reason phrase of 308.
+_REDIRECT_PHRASES = {301: 'Moved Permanently', 302: 'Found', 303: 'See Other',
+                     307: 'Temporary Redirect', 308: 'Permanent Redirect'}
 _logger = loggers.getlogger('p.Redirect')
 
 
@@ -46,12 +56,25 @@ class IRedirectHandler(resource.Resource):
 
 class RedirectHandler(IRedirectHandler):
     """
-
+    one instance per redirect url, its response is computed once.
     """
 
-    def __init__(self, redirect_url):
+    isLeaf = True
+
+    def __init__(self, redirect_url, redirect_code=302, max_age=None):
+        """
+
+        :param redirect_url:
+        :param redirect_code: 301, 302, 303, 307 or 308.
+        :param max_age: seconds browsers and caches may keep the redirect, optional.
+        :return:
+        """
         IRedirectHandler.__init__(self)
-        self._redirect_url = redirect_url
+        self._redirect_code = redirect_code
+        self._redirect_phrase = _REDIRECT_PHRASES.get(redirect_code)
+        self._redirect_headers = [('location', [redirect_url])]
+        if max_age is not None:
+            self._redirect_headers.append(('cache-control', ['max-age={}'.format(max_age)]))
 
     def render_get(self, request):
         """
@@ -59,7 +82,9 @@ class RedirectHandler(IRedirectHandler):
         :param request:
         :return:
         """
-        request.redirect(self._redirect_url)
+        request.setResponseCode(self._redirect_code, self._redirect_phrase)
+        for header_name, header_values in self._redirect_headers:
+            request.responseHeaders.setRawHeaders(header_name, header_values)
         return ''
 
 
@@ -68,21 +93,106 @@ class RedirectDispatcher(IRedirectHandler):
 
     """
 
-    def __init__(self, default_redirect_url, redirect_rules):
+    def __init__(self, default_redirect_url, redirect_rules, cache_size=1024, redirect_code=302, max_age=None):
         """
 
         :param default_redirect_url:
         :param redirect_rules:
+        :param cache_size: paths to keep the matched redirect url of.
+        :param redirect_code: 301, 302, 303, 307 or 308.
+        :param max_age: seconds browsers and caches may keep a redirect, optional.
         :return:
         """
         IRedirectHandler.__init__(self)
         self._default_redirect_url = default_redirect_url
-        self._redirect_rules = redirect_rules \
-                               | collect(lambda it: (it[0], it[1], len(it[0]))) \
-                               | as_set \
-                               | as_tuple \
-                               | sort(cmp=lambda x, y: cmp(y[2], x[2])) \
-                               | as_tuple
+        self._cache_size = cache_size
+        self._redirect_code = redirect_code
+        self._max_age = max_age
+
+        # (matcher, redirect url -> handler), always replaced as a whole.
+        self._redirects = (None, {})
+        # the matcher of the given rules alone, and domain -> redirect urls of the backend.
+        self._rules_matcher = None
+        self._redirect_rules = []
+        self._backend_urls = {}
+        self.update(redirect_rules)
+
+    def update(self, redirect_rules):
+        """
+        compile redirect_rules and swap them in, a request sees either the old or the new rules.
+        called off the reactor thread, so requests never wait for a compile.
+        redirects of backend domains are kept.
+
+        :param redirect_rules:
+        :return:
+        """
+        self._rules_matcher = HostRedirectMatcher(redirect_rules, cache_size=self._cache_size)
+        self._redirect_rules = list(redirect_rules)
+        self._update_all()
+
+    def update_backend(self, backend_urls):
+        """
+        replace the redirects of every backend domain, compiles all rules again.
+
+        :param backend_urls: domain -> redirect urls of its nodes.
+        :return: True if the redirects changed.
+        """
+        backend_urls = backend_urls.items() | collect(lambda it: (it[0], it[1] | as_tuple)) | as_dict
+        if backend_urls == self._backend_urls:
+            return False
+
+        self._backend_urls = backend_urls
+        self._update_all()
+        return True
+
+    def update_host(self, domain, redirect_urls):
+        """
+        replace the redirects of one backend domain, only the rules of its host are compiled again.
+
+        :param domain:
+        :param redirect_urls: redirect urls of the nodes of domain, none removes its redirects.
+        :return: True if the redirects changed.
+        """
+        redirect_urls = redirect_urls | as_tuple
+        if self._backend_urls.get(domain, ()) == redirect_urls:
+            return False
+
+        if redirect_urls:
+            self._backend_urls[domain] = redirect_urls
+        else:
+            self._backend_urls.pop(domain, None)
+
+        # the given rules of the host come along, a replace drops every rule of it.
+        redirect_matcher, redirect_handlers = self._redirects
+        host_rules = self._rules_matcher.rules(domain) + (redirect_urls | collect(lambda it: ('', it)) | as_list)
+
+        # handlers of urls gone stay until the next full update.
+        redirect_handlers = dict(redirect_handlers)
+        redirect_handlers.update(self._redirect_handlers(redirect_urls, redirect_handlers))
+        self._redirects = (redirect_matcher.replace(domain, host_rules), redirect_handlers)
+        return True
+
+    def _update_all(self):
+        redirect_rules = list(self._redirect_rules)
+        for domain, redirect_urls in self._backend_urls.items():
+            redirect_rules.extend(redirect_urls | collect(lambda it, domain=domain: ('//' + domain, it)))
+
+        redirect_matcher = HostRedirectMatcher(redirect_rules, cache_size=self._cache_size)
+        redirect_handlers = self._redirect_handlers((redirect_rules | collect(lambda it: it[1]) | as_list) +
+                                                    [self._default_redirect_url],
+                                                    self._redirects[1])
+        self._redirects = (redirect_matcher, redirect_handlers)
+
+    def _redirect_handlers(self, redirect_urls, prev_handlers):
+        # many rules share a redirect url, they share its handler too.
+        redirect_handlers = {}
+        for redirect_url in redirect_urls:
+            if redirect_url not in redirect_handlers:
+                redirect_handlers[redirect_url] = prev_handlers.get(redirect_url) or \
+                                                  RedirectHandler(redirect_url,
+                                                                  redirect_code=self._redirect_code,
+                                                                  max_age=self._max_age)
+        return redirect_handlers
 
     def getChild(self, path, request):
         """
@@ -91,9 +201,46 @@ class RedirectDispatcher(IRedirectHandler):
         :param request:
         :return:
         """
-        redirect_rule = self._redirect_rules | select(lambda it: re.match(it[0], request.path)) | first
-        return RedirectHandler(redirect_rule[1]) \
-            if redirect_rule else RedirectHandler(self._default_redirect_url)
+        redirect_matcher, redirect_handlers = self._redirects
+        redirect_url = redirect_matcher.match(request.getHeader('host'), request.path)
+        return redirect_handlers[redirect_url or self._default_redirect_url]
+
+
+def _watch_redirects(backend, redirect_dispatcher):
+    # the redirect of a node redirects every request of its domain.
+    route_table = RouteTable()
+    route_table.load(*backend.snapshot())
+
+    backend_urls = _backend_urls(route_table.details())
+    redirect_dispatcher.update_backend(backend_urls)
+    _logger.w('load redirects of %s domains from backend.', len(backend_urls))
+
+    for proxy_event in backend.watches(recursive=True):
+        if proxy_event.name is None:
+            route_table.load(*backend.snapshot())
+            backend_urls = _backend_urls(route_table.details())
+            if redirect_dispatcher.update_backend(backend_urls):
+                _logger.w('reload redirects of %s domains from backend.', len(backend_urls))
+            continue
+
+        if not route_table.apply(proxy_event):
+            continue
+
+        # most changes are of addrs and ports, only look at the domain of the event.
+        redirect_urls = _redirect_urls(route_table.nodes(proxy_event.name))
+        if redirect_dispatcher.update_host(proxy_event.name, redirect_urls):
+            _logger.w('reload redirects of domain %s from backend.', proxy_event.name)
+
+
+def _backend_urls(proxy_details):
+    return proxy_details \
+           | collect(lambda it: (it.name, _redirect_urls(it.nodes))) \
+           | select(lambda it: it[1]) \
+           | as_dict
+
+
+def _redirect_urls(nodes):
+    return nodes | collect(lambda it: it.redirect) | select(lambda it: it) | as_set | sort | as_tuple
 
 
 def _get_callargs():
@@ -103,11 +250,31 @@ def _get_callargs():
                         default=os.getenv(constants.DEFAULT_REDIRECT_URL))
 
     parser.add_argument('-redirect-rules', dest='redirect_rules',
-                        default=os.getenv(constants.REDIRECT_RULES, ''))
+                        default=os.getenv(constants.REDIRECT_RULES, ''),
+                        help='pattern=url rules separated by ;, a pattern like //host/path or '
+                             '//*.domain/path only applies to requests of that host.')
+
+    parser.add_argument('-redirect-cache-size', dest='redirect_cache_size', type=int,
+                        default=os.getenv(constants.REDIRECT_CACHE_SIZE, 1024))
+
+    parser.add_argument('-redirect-code', dest='redirect_code', type=int,
+                        default=os.getenv(constants.REDIRECT_CODE, 302))
+
+    parser.add_argument('-redirect-max-age', dest='redirect_max_age', type=int,
+                        default=os.getenv(constants.REDIRECT_MAX_AGE))
+
+    parser.add_argument('-backend', dest='backend', default=os.getenv(constants.BACKEND_ENV),
+                        help='backend to load redirects of domains from and watch, optional.')
+    parser.add_argument('-networks', dest='networks', default=os.getenv(constants.NETWORKS_ENV),
+                        help='interested container networks of the backend.')
 
     parser.add_argument('--addr', dest='addr',
                         default=os.getenv(constants.ADDR_ENV, '0.0.0.0:8888'))
 
+    parser.add_argument('--workers', dest='workers', type=int,
+                        default=os.getenv(constants.WORKERS_ENV, 1),
+                        help='processes to serve with on one socket, default is 1.')
+
     return parser.parse_args()
 
 
@@ -118,6 +285,10 @@ def main():
         _logger.e('%s env not set, use -default-redirect-url instead, program exit.', constants.DEFAULT_REDIRECT_URL)
         sys.exit(1)
 
+    if callargs.redirect_code not in _REDIRECT_PHRASES:
+        _logger.e('redirect code must be one of %s, program exit.', _REDIRECT_PHRASES.keys() | sort | as_list)
+        sys.exit(1)
+
     listen_addr = callargs.addr | split(':')
     if len(listen_addr) != __ADDRPAIR_LEN:
         _logger.e('addr must like 0.0.0.0:8888 format, program exit.')
@@ -130,12 +301,42 @@ def main():
                      | select(lambda it: len(it) == 2) \
                      | as_list
 
-    redirect_dispatcher = RedirectDispatcher(default_redirect_url, redirect_rules)
-    listen_port, listen_host = listen_addr[1] | as_int, listen_addr[0]
-    reactor.listenTCP(listen_port, server.Site(redirect_dispatcher), interface=listen_host)
+    backend = None
+    if callargs.backend:
+        backend_type = urlparse.urlparse(callargs.backend | strip).scheme | lowcase
+        backend_cls = __BACKEND_TYPES.get(backend_type)
+        if not backend_cls:
+            _logger.e('backend[type=%s] not found, program exit.', backend_type)
+            sys.exit(1)
 
+        networks = callargs.networks | split('[,;\s]') if callargs.networks else callargs.networks
+        backend = backend_cls(callargs.backend, networks=networks)
+
+    listen_port, listen_host = listen_addr[1] | as_int, listen_addr[0]
     _logger.w('waitting request on [tcp/%s].', callargs.addr)
-    reactor.run()
+    workers.serve(lambda: _redirect_site(callargs, default_redirect_url, redirect_rules, backend),
+                  listen_host,
+                  listen_port,
+                  workers=callargs.workers,
+                  worker_module='proxywall.redirect')
+
+
+def _redirect_site(callargs, default_redirect_url, redirect_rules, backend):
+    # every worker has its own dispatcher and watches.
+    redirect_dispatcher = RedirectDispatcher(default_redirect_url, redirect_rules,
+                                             cache_size=callargs.redirect_cache_size,
+                                             redirect_code=callargs.redirect_code,
+                                             max_age=callargs.redirect_max_age)
+
+    if backend:
+        watch_thread = threading.Thread(
+            target=supervisor.supervise(min_seconds=2, max_seconds=64)(_watch_redirects),
+            args=(backend, redirect_dispatcher),
+            name='watches')
+        watch_thread.setDaemon(True)
+        watch_thread.start()
+
+    return server.Site(redirect_dispatcher)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+"""
+    ways to reload the proxy after its config changed.
+"""
+
+import os
+import signal
+import time
+
+from proxywall import commands
+from proxywall import loggers
+
+_logger = loggers.getlogger('p.Reloads')
+
+
+def signum(signame):
+    """
+
+    :param signame: signal name like HUP or SIGHUP.
+    :return: the signal number, None if no such signal.
+    """
+    signame = signame.upper()
+    if not signame.startswith('SIG'):
+        signame = 'SIG' + signame
+    return getattr(signal, signame, None) if not signame.startswith('SIG_') else None
+
+
+class CommandReload(object):
+    """
+    reload by running a command, like 'nginx -s reload'.
+    """
+
+    def __init__(self, cmd, timeout=None):
+        """
+
+        :param cmd:
+        :param timeout: seconds to wait before kill the command, optional.
+        :return:
+        """
+        self._cmd = cmd
+        self._timeout = timeout
+
+    def reload(self):
+        """
+
+        :return: True if the command exited with 0.
+        """
+        _logger.w('run [post_cmd=%s].', self._cmd)
+        rc, cmdout, cmderr = commands.run(self._cmd, timeout=self._timeout)
+        if rc != 0:
+            _logger.w('run %s with exitcode %s.', self._cmd, rc)
+        return rc == 0
+
+
+class SignalReload(object):
+    """
+    reload by sending a signal to the pid in pidfile, without fork a command.
+    """
+
+    def __init__(self, pidfile, signame='HUP', confirm_timeout=None):
+        """
+
+        :param pidfile: pidfile of the proxy master process.
+        :param signame: signal to send, HUP by default.
+        :param confirm_timeout: seconds to wait for the pidfile or the worker processes to change, optional.
+        :return:
+        """
+        self._pidfile = pidfile
+        self._signame = signame
+        self._signum = signum(signame)
+        if not self._signum:
+            raise ValueError('no such signal {}'.format(signame))
+        self._confirm_timeout = confirm_timeout or 0
+
+    def reload(self):
+        """
+
+        :return: True if the signal was sent, and confirmed when confirm_timeout set.
+        """
+        pid = _read_pid(self._pidfile)
+        if not pid:
+            _logger.w('no pid found in %s, skip reload.', self._pidfile)
+            return False
+
+        # workers of the current generation, a reload starts new ones.
+        pidfile_stat = _stat_pidfile(self._pidfile)
+        children = _children(pid) if self._confirm_timeout else set()
+
+        _logger.w('send [signal=%s] to [pid=%s].', self._signame, pid)
+        try:
+            os.kill(pid, self._signum)
+        except OSError:
+            _logger.ex('send signal to pid %s occurs error.', pid)
+            return False
+
+        if not self._confirm_timeout:
+            return True
+
+        confirm_deadline = time.time() + self._confirm_timeout
+        while time.time() < confirm_deadline:
+            time.sleep(0.1)
+            if _stat_pidfile(self._pidfile) != pidfile_stat or _children(pid) - children:
+                return True
+
+        _logger.w('reload of pid %s not confirmed in %s seconds.', pid, self._confirm_timeout)
+        return False
+
+
+def _read_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip() or 0)
+    except (IOError, ValueError):
+        return None
+
+
+def _stat_pidfile(pidfile):
+    try:
+        pidfile_stat = os.stat(pidfile)
+        return pidfile_stat.st_ino, pidfile_stat.st_mtime, pidfile_stat.st_size
+    except OSError:
+        return None
+
+
+def _children(pid):
+    children = set()
+    for proc in os.listdir('/proc'):
+        if not proc.isdigit():
+            continue
+
+        try:
+            with open('/proc/{}/stat'.format(proc)) as f:
+                proc_stat = f.read()
+        except IOError:
+            continue
+
+        # comm may contain spaces and parens, ppid is the second field after its closing paren.
+        proc_fields = proc_stat.rsplit(')', 1)[-1].split()
+        if len(proc_fields) > 1 and proc_fields[1] == str(pid):
+            children.add(int(proc))
+
+    return children
@@ -0,0 +1,184 @@
+"""
+    local mirror of the backend route table.
+"""
+
+import collections
+import threading
+
+from proxywall.backend import *
+from proxywall.commons import *
+
+# nodes of one proto of a domain, ordered like ProxyDetail.nodes.
+ProxyGroup = collections.namedtuple('ProxyGroup', ['proto', 'nodes'])
+
+
+class RouteTable(object):
+    """
+
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._index = 0
+        self._version = 0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._context = None
+        self._context_lock = threading.Lock()
+
+    @property
+    def index(self):
+        """
+        backend index the table is current with.
+        """
+        return self._index
+
+    @property
+    def version(self):
+        """
+        bumped on every change of the table.
+        """
+        return self._version
+
+    @property
+    def stale(self):
+        """
+        True until a snapshot is loaded, and again from expire till the next one.
+        """
+        return self._stale
+
+    def expire(self):
+        """
+        mark the table out of sync with the backend, only load clears it.
+
+        :return:
+        """
+        self._stale = True
+
+    def load(self, index, proxy_events):
+        """
+        replace the whole table with a backend snapshot.
+
+        :param index:
+        :param proxy_events:
+        :return:
+        """
+        routes = {}
+        for proxy_event in proxy_events:
+            routes.setdefault(proxy_event.name, {})[proxy_event.uuid] = proxy_event.node
+
+        with self._lock:
+            self._routes = routes
+            self._index = index or 0
+            self._version += 1
+            self._stale = False
+
+    def apply(self, proxy_event):
+        """
+        apply one change of a single node.
+
+        :param proxy_event:
+        :return: True if the table changed.
+        """
+        with self._lock:
+            if proxy_event.index and proxy_event.index <= self._index:
+                return False
+
+            self._index = proxy_event.index or self._index
+            if not self._apply(proxy_event):
+                return False
+
+            self._version += 1
+            return True
+
+    def _apply(self, proxy_event):
+        name, uuid, node = proxy_event.name, proxy_event.uuid, proxy_event.node
+        nodes = self._routes.get(name)
+
+        if not node:
+            if not nodes or uuid not in nodes:
+                return False
+            del nodes[uuid]
+            if not nodes:
+                del self._routes[name]
+            return True
+
+        if nodes and uuid in nodes and tuple(nodes[uuid]) == tuple(node):
+            return False
+
+        self._routes.setdefault(name, {})[uuid] = node
+        return True
+
+    def nodes(self, name):
+        """
+
+        :param name:
+        :return: nodes of name in the table.
+        """
+        with self._lock:
+            return (self._routes.get(name) or {}).values()
+
+    def details(self):
+        """
+
+        :return: ProxyDetails of all names in the table, ordered by name.
+        """
+        with self._lock:
+            return self._details()
+
+    def context(self):
+        """
+        template context of the table, built once per version and shared by every render of it.
+
+        :return:
+        """
+        with self._context_lock:
+            with self._lock:
+                if self._context and self._context[0] == self._version:
+                    return self._context[1]
+                version, proxy_details = self._version, self._details()
+
+            self._context = (version, _build_context(proxy_details))
+            return self._context[1]
+
+    def _details(self):
+        return self._routes.items() \
+               | sort(key=lambda it: it[0]) \
+               | collect(lambda it: ProxyDetail(it[0], nodes=it[1].values())) \
+               | as_list
+
+
+def _build_context(proxy_details):
+    # everything templates used to compute per domain on every render, computed once here.
+    proxy_groups, proxy_protos, proxy_redirects, proxy_weights = {}, {}, {}, {}
+    proxy_tlds, proxy_suffixes = {}, {}
+    for proxy_detail in proxy_details:
+        name, nodes = proxy_detail.name, proxy_detail.nodes
+
+        proto_nodes = collections.OrderedDict()
+        for node in nodes | sort(key=lambda it: it.proto):
+            proto_nodes.setdefault(node.proto, []).append(node)
+        proxy_groups[name] = proto_nodes.items() | collect(lambda it: ProxyGroup(it[0], it[1] | as_tuple)) | as_tuple
+
+        for proto in proto_nodes:
+            proxy_protos.setdefault(proto, []).append(proxy_detail)
+
+        redirect = nodes | select(lambda it: it.redirect) | collect(lambda it: it.redirect) | first
+        if redirect:
+            proxy_redirects[name] = redirect
+
+        proxy_weights[name] = nodes | collect(lambda it: it.weight) | add
+
+        labels = name | split('\\.')
+        proxy_tlds.setdefault(labels[-1], []).append(proxy_detail)
+        proxy_suffixes.setdefault('.'.join(labels[-2:]), []).append(proxy_detail)
+
+    return {
+        'proxy_details': proxy_details,
+        'proxy_groups': proxy_groups,
+        'proxy_protos': proxy_protos,
+        'proxy_redirects': proxy_redirects,
+        'proxy_weights': proxy_weights,
+        'proxy_tlds': proxy_tlds,
+        'proxy_suffixes': proxy_suffixes
+    }
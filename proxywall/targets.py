@@ -0,0 +1,127 @@
+"""
+    configs rendered from one route table, each with its own way to apply it.
+"""
+
+import collections
+import json
+import os
+
+from proxywall import haproxy
+from proxywall import reloads
+from proxywall import template
+from proxywall.commons import *
+
+__all__ = ['ProxyTarget', 'load_targets', 'check_targets']
+
+_ProxyTarget = collections.namedtuple('ProxyTarget', ['name', 'template_engine', 'template_dest',
+                                                      'fragment_engine', 'fragment_dest', 'haproxy_driver',
+                                                      'prev_cmd', 'reloader', 'cmd_timeout', 'reload_interval'])
+
+_TARGET_OPTIONS = ['name', 'template_src', 'template_dest', 'template_cache', 'fragment_src', 'fragment_dest',
+                   'haproxy_socket', 'haproxy_slots', 'prev_cmd', 'post_cmd', 'reload_pidfile', 'reload_signal',
+                   'reload_confirm', 'reload_interval', 'cmd_timeout']
+
+
+class ProxyTarget(_ProxyTarget):
+    """
+
+    """
+
+    __slots__ = ()
+
+    def __new__(cls,
+                template_src=None, template_dest=None, template_cache=None,
+                fragment_src=None, fragment_dest=None, haproxy_socket=None, haproxy_slots=None,
+                prev_cmd=None, post_cmd=None, reload_pidfile=None, reload_signal=None, reload_confirm=None,
+                reload_interval=None, cmd_timeout=None, name=None):
+
+        if not template_src or not template_dest:
+            raise ValueError('template_src and template_dest of target must be set.')
+
+        if not os.path.isfile(template_src) or (fragment_src and not os.path.isfile(fragment_src)):
+            raise ValueError('template_src and fragment_src of target must be files.')
+
+        if fragment_src and not fragment_dest:
+            raise ValueError('fragment_dest of target must be set with fragment_src.')
+
+        if not post_cmd and not reload_pidfile:
+            raise ValueError('post_cmd or reload_pidfile of target must be set.')
+
+        if reload_pidfile:
+            reloader = reloads.SignalReload(reload_pidfile,
+                                            signame=reload_signal or 'HUP',
+                                            confirm_timeout=reload_confirm)
+        else:
+            reloader = reloads.CommandReload(post_cmd, timeout=cmd_timeout)
+
+        return super(ProxyTarget, cls).__new__(
+            cls,
+            name or template_dest,
+            template.TemplateEngine(template_src, cache_dir=template_cache),
+            template_dest,
+            template.TemplateEngine(fragment_src, cache_dir=template_cache) if fragment_src else None,
+            fragment_dest,
+            haproxy.SlotDriver(haproxy_socket, slots=haproxy_slots or 10) if haproxy_socket else None,
+            prev_cmd,
+            reloader,
+            cmd_timeout,
+            reload_interval)
+
+    @staticmethod
+    def from_dict(dict_obj, defaults=None):
+        """
+
+        :param dict_obj: target options, keys are the long option names of the daemon.
+        :param defaults: options to use when not set in dict_obj.
+        :return:
+        """
+        unknown_options = dict_obj.keys() | select(lambda it: it not in _TARGET_OPTIONS) | as_list
+        if unknown_options:
+            raise ValueError('unknown target options {}.'.format(unknown_options | join(', ')))
+
+        target_options = dict(defaults or {})
+        target_options.update(dict_obj)
+        return ProxyTarget(**target_options)
+
+
+def load_targets(targets_file, defaults=None):
+    """
+    load targets from a json file of a list of target options.
+
+    :param targets_file:
+    :param defaults: options to use when not set in a target.
+    :return:
+    """
+    with open(targets_file) as f:
+        targets_obj = json.load(f)
+
+    if not isinstance(targets_obj, list):
+        raise ValueError('targets file {} must be a list.'.format(targets_file))
+
+    proxy_targets = targets_obj | collect(lambda it: ProxyTarget.from_dict(it, defaults=defaults)) | as_list
+    check_targets(proxy_targets)
+    return proxy_targets
+
+
+def check_targets(proxy_targets):
+    """
+    targets must not write the same files, nor into the fragment directory of another,
+    which would remove them as vanished fragments.
+
+    :param proxy_targets:
+    :return:
+    :raise ValueError: if two targets share a dest.
+    """
+    template_dests = proxy_targets | collect(lambda it: os.path.abspath(it.template_dest)) | as_list
+    fragment_dests = proxy_targets \
+                     | select(lambda it: it.fragment_engine) \
+                     | collect(lambda it: os.path.abspath(it.fragment_dest)) \
+                     | as_list
+
+    for dests, dest_option in ((template_dests, 'template_dest'), (fragment_dests, 'fragment_dest')):
+        if len(dests | as_set) != len(dests):
+            raise ValueError('targets must not share a {}.'.format(dest_option))
+
+    shared_dests = template_dests | select(lambda it: os.path.dirname(it) in fragment_dests) | as_list
+    if shared_dests:
+        raise ValueError('template_dest {} of target is in a fragment_dest.'.format(shared_dests | join(', ')))
@@ -1,11 +1,12 @@
+import codecs
 import os
 
-from jinja2 import Environment
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, TemplateNotFound
 
 
 def render(source, context):
     """
-    
+
     :param source:
     :param context:
     :return:
@@ -14,3 +15,79 @@ def render(source, context):
     env = Environment()
     env.filters['exists'] = os.path.exists
     return env.from_string(source=source).render(context)
+
+
+class TemplateEngine(object):
+    """
+    compiles a template file once, and again only when its mtime or size changed.
+    """
+
+    def __init__(self, template_src, cache_dir=None):
+        """
+
+        :param template_src: jinja2 template file, includes are looked up in its directory.
+        :param cache_dir: directory to keep compiled bytecode across restarts, optional.
+        :return:
+        """
+        template_src = os.path.abspath(template_src)
+        self._src = template_src
+        self._name = os.path.basename(template_src)
+
+        bytecode_cache = None
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+        self._env = Environment(loader=_TemplateLoader(os.path.dirname(template_src)),
+                                bytecode_cache=bytecode_cache,
+                                auto_reload=True)
+        self._env.filters['exists'] = os.path.exists
+
+    @property
+    def version(self):
+        """
+        (mtime, size) of the template file, changes whenever it is edited.
+        """
+        return _stat(self._src)
+
+    def render(self, context):
+        """
+
+        :param context:
+        :return:
+        """
+        return self._env.get_template(self._name).render(context)
+
+    def generate(self, context):
+        """
+        render piece by piece, without holding the whole output in memory.
+
+        :param context:
+        :return: a generator of unicode chunks.
+        """
+        return self._env.get_template(self._name).generate(context)
+
+
+class _TemplateLoader(BaseLoader):
+    def __init__(self, searchpath):
+        self._searchpath = searchpath
+
+    def get_source(self, environment, template):
+        template_path = os.path.join(self._searchpath, *template.split('/'))
+        template_stat = _stat(template_path)
+        if not template_stat:
+            raise TemplateNotFound(template)
+
+        with codecs.open(template_path, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        return source, template_path, lambda: _stat(template_path) == template_stat
+
+
+def _stat(path):
+    try:
+        path_stat = os.stat(path)
+        return path_stat.st_mtime, path_stat.st_size
+    except OSError:
+        return None
@@ -0,0 +1,34 @@
+import unittest
+
+import jsonselect
+
+from proxywall import accessors
+
+_CONTAINER = {'Id': 'c1',
+              'State': {'Status': 'running', 'Health': {'Status': 'healthy'}},
+              'Config': {'Labels': {'Id': 'label'}}}
+
+
+class AccessorsTest(unittest.TestCase):
+    def test_select_key(self):
+        self.assertEqual(accessors.select({'VHOST': 'a.com'}, '.VHOST'), 'a.com')
+        self.assertIsNone(accessors.select({'VPORT': '80'}, '.VHOST'))
+        self.assertIsNone(accessors.select(None, '.VHOST'))
+
+        # a top level lookup, jsonselect would match the keys deeper too.
+        self.assertEqual(accessors.select(_CONTAINER, '.Id'), 'c1')
+        self.assertIsNone(accessors.select(_CONTAINER, '.Status'))
+
+    def test_select_like_jsonselect(self):
+        for selector in ['.State .Status', ':root > .State > .Status', '.Health .Status']:
+            self.assertEqual(accessors.select(_CONTAINER, selector), jsonselect.select(selector, _CONTAINER))
+
+    def test_select_keys(self):
+        self.assertEqual(accessors.select_keys(_CONTAINER, ('State', 'Status')), 'running')
+        self.assertEqual(accessors.select_keys(_CONTAINER, ('State', 'Health', 'Status')), 'healthy')
+        self.assertIsNone(accessors.select_keys(_CONTAINER, ('State', 'Status', 'Code')))
+        self.assertIsNone(accessors.select_keys(_CONTAINER, ('Network', 'IPAddress')))
+
+
+if __name__ == '__main__':
+    unittest.main()
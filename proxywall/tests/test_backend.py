@@ -0,0 +1,67 @@
+import itertools
+import json
+import unittest
+
+import etcd
+
+from proxywall.backend import *
+from proxywall.commons import *
+
+
+class _FakeEtcdClient(object):
+    """
+    replies to watches from a list of results, an exception in the list is raised instead.
+    """
+
+    def __init__(self, *results):
+        self.indexes = []
+        self._results = list(results)
+
+    def watch(self, key, index=None, timeout=None, recursive=None):
+        self.indexes.append(index)
+        result = self._results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _set_result(name, uuid, addr, index):
+    key = '/proxywall/{}/@nodes/{}'.format(name | split(r'\.') | reverse | join('/'), uuid)
+    value = json.dumps(ProxyNode(uuid, addr, 80).to_dict())
+    return etcd.EtcdResult('set', node={'key': key, 'value': value, 'modifiedIndex': index})
+
+
+def _watches(etcd_client, count, index=None):
+    # the client asks etcd for its machines when created, no etcd runs here.
+    etcd_class, etcd.Client = etcd.Client, lambda **kwargs: etcd_client
+    try:
+        etcd_backend = EtcdBackend('etcd://127.0.0.1:2379')
+    finally:
+        etcd.Client = etcd_class
+    return list(itertools.islice(etcd_backend.watches(recursive=True, index=index), count)), etcd_backend
+
+
+class EtcdWatchesTest(unittest.TestCase):
+    def test_resume_after_last_seen_index(self):
+        etcd_client = _FakeEtcdClient(_set_result('a.com', 'n1', '10.0.0.1', 11),
+                                      _set_result('a.com', 'n2', '10.0.0.2', 15))
+        proxy_events, etcd_backend = _watches(etcd_client, 2, index=11)
+
+        self.assertEqual([(it.name, it.uuid, it.index) for it in proxy_events], [('a.com', 'n1', 11),
+                                                                                 ('a.com', 'n2', 15)])
+        self.assertEqual(etcd_client.indexes, [11, 12])
+        self.assertEqual(etcd_backend.index, 15)
+
+    def test_resync_on_cleared_index(self):
+        cleared = etcd.EtcdEventIndexCleared('the event in requested index is outdated and cleared',
+                                             payload={'errorCode': 401, 'index': 1020})
+        etcd_client = _FakeEtcdClient(cleared, _set_result('a.com', 'n1', '10.0.0.1', 1021))
+        proxy_events, etcd_backend = _watches(etcd_client, 2, index=3)
+
+        self.assertEqual([(it.name, it.index) for it in proxy_events], [(None, 1020), ('a.com', 1021)])
+        self.assertEqual(etcd_client.indexes, [3, 1021])
+        self.assertEqual(etcd_backend.index, 1021)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+
+from proxywall import events
+from proxywall.backend import *
+
+
+class _FakeClient(object):
+    def __init__(self, containers, inspected=None, events=None):
+        self._containers = containers
+        self._inspected = inspected or {}
+        self._events = events or []
+
+    def containers(self, filters=None):
+        return self._containers
+
+    def inspect_container(self, container_id):
+        return self._inspected[container_id]
+
+    def events(self, decode=None, filters=None):
+        return iter(self._events)
+
+
+class _FakeBackend(object):
+    def __init__(self):
+        self.writes = []
+
+    def register(self, name, node, ttl=None):
+        self.writes.append(('register', name, node.uuid))
+
+    def refresh(self, name, node, ttl):
+        self.writes.append(('refresh', name, node.uuid))
+
+    def unregister(self, name, node):
+        self.writes.append(('unregister', name, node.uuid))
+
+
+class _CountingHeartbeat(events._Heartbeat):
+    def __init__(self, **kwargs):
+        super(_CountingHeartbeat, self).__init__(**kwargs)
+        self.throttles = 0
+
+    def throttle(self):
+        self.throttles += 1
+
+
+def _container(container_id, vhost=None):
+    labels = {'proxywall.vhost': vhost, 'proxywall.vport': '80', 'proxywall.vaddr': '10.0.0.1'} if vhost else {}
+    return {'Id': container_id, 'Labels': labels}
+
+
+class HeartbeatTest(unittest.TestCase):
+    def test_capacity(self):
+        self.assertEqual(events._Heartbeat(interval=30, ttl=60, jitter=5, rate=10).capacity, 250)
+        self.assertIsNone(events._Heartbeat(interval=30, ttl=60, jitter=5).capacity)
+
+    def test_throttle_backend_writes_only(self):
+        backend = _FakeBackend()
+        client = _FakeClient([_container('c1', 'a.com'), _container('c2', 'b.com'),
+                              _container('c3'), _container('c4'), _container('c5')])
+        heartbeat = _CountingHeartbeat(interval=30, ttl=60, rate=10, workers=1)
+        registry, cache, filters = {}, {}, {'label': 'proxywall.vhost'}
+
+        events._heartbeat_containers(backend, client, registry, cache, heartbeat, filters)
+        events._heartbeat_containers(backend, client, registry, cache, heartbeat, filters)
+
+        self.assertEqual(sorted(backend.writes), [('refresh', 'a.com', 'c1'), ('refresh', 'b.com', 'c2'),
+                                                  ('register', 'a.com', 'c1'), ('register', 'b.com', 'c2')])
+        self.assertEqual(heartbeat.throttles, 4)
+
+
+class ProxyEntryTest(unittest.TestCase):
+    def test_inspect_payload(self):
+        proxy_domain, proxy_node = events._proxy_entry({
+            'Id': 'c1',
+            'State': {'Status': 'running', 'Health': {'Status': 'healthy'}},
+            'Config': {'Env': ['VHOST=a.com', 'VPORT=80', 'VNETWORK=web', 'VWEIGHT=3'], 'Tty': False},
+            'NetworkSettings': {'Networks': {'web': {'IPAddress': '10.0.0.1'}}}})
+
+        self.assertEqual(proxy_domain, 'a.com')
+        self.assertEqual((proxy_node.uuid, proxy_node.addr, proxy_node.port, proxy_node.weight),
+                         ('c1', '10.0.0.1', '80', 3))
+
+    def test_ignore_unhealthy(self):
+        self.assertIsNone(events._proxy_entry({
+            'Id': 'c1',
+            'State': {'Status': 'running', 'Health': {'Status': 'unhealthy'}},
+            'Config': {'Env': ['VHOST=a.com', 'VPORT=80', 'VADDR=10.0.0.1']}}))
+
+
+def _inspected(container_id, vhost, running=True):
+    return {'Id': container_id,
+            'State': {'Status': 'running' if running else 'exited', 'Running': running},
+            'Config': {'Env': ['VHOST=' + vhost, 'VPORT=80', 'VADDR=10.0.0.1']}}
+
+
+class HandleEventTest(unittest.TestCase):
+    def _handle(self, client, registry, *events_):
+        backend, cache, heartbeat = _FakeBackend(), {}, events._Heartbeat(workers=1)
+        for event in events_:
+            events._handle_event(backend, client, registry, cache, heartbeat, None, event)
+        return backend.writes
+
+    def test_register_and_unregister(self):
+        client = _FakeClient([], inspected={'c1': _inspected('c1', 'a.com')})
+        registry = {}
+
+        writes = self._handle(client, registry,
+                              {'Type': 'container', 'id': 'c1', 'status': 'start'},
+                              {'Type': 'network', 'id': 'c1', 'status': 'die'},
+                              {'Type': 'container', 'id': 'c1', 'status': 'die'},
+                              {'Type': 'container', 'id': 'c1', 'status': 'destroy'})
+
+        self.assertEqual(writes, [('register', 'a.com', 'c1'), ('unregister', 'a.com', 'c1')])
+        self.assertEqual(registry, {})
+
+    def test_ignore_exited_container(self):
+        client = _FakeClient([], inspected={'c1': _inspected('c1', 'a.com', running=False)})
+        registry = {'c1': ('a.com', ProxyNode('c1', '10.0.0.1', '80'))}
+
+        # started and exited at once, inspected after it exited.
+        writes = self._handle(client, registry, {'Type': 'container', 'id': 'c1', 'status': 'start'})
+
+        self.assertEqual(writes, [('unregister', 'a.com', 'c1')])
+        self.assertEqual(registry, {})
+
+    def test_reconcile_vanished_containers(self):
+        backend = _FakeBackend()
+        client = _FakeClient([{'Id': 'c1', 'State': 'running'}], inspected={'c1': _inspected('c1', 'a.com')})
+        registry = {'c2': ('b.com', ProxyNode('c2', '10.0.0.2', '80'))}
+        cache = {'c3': ('running', None)}
+
+        events._heartbeat_containers(backend, client, registry, cache, events._Heartbeat(workers=1), None)
+
+        self.assertEqual(backend.writes, [('unregister', 'b.com', 'c2'), ('register', 'a.com', 'c1')])
+        self.assertEqual(sorted(registry.keys()), ['c1'])
+        self.assertEqual(sorted(cache.keys()), ['c1'])
+
+    def test_resubscribe_closed_events(self):
+        client = _FakeClient([], events=[])
+        self.assertRaises(IOError, events._event_loop,
+                          _FakeBackend(), client, {}, {}, events._Heartbeat(workers=1), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from contextlib import closing
+
+from proxywall import haproxy
+from proxywall.backend import *
+
+
+class _FakeHAProxy(object):
+    """
+    a stats socket in interactive mode, replies like haproxy to the commands it is sent.
+    """
+
+    def __init__(self, socket_path, replies=None):
+        self.commands = []
+        self._replies = replies or {}
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(socket_path)
+        self._socket.listen(1)
+
+        serve_thread = threading.Thread(target=self._serve)
+        serve_thread.setDaemon(True)
+        serve_thread.start()
+
+    def close(self):
+        self._socket.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except socket.error:
+                return
+
+            with closing(conn):
+                self._serve_conn(conn)
+
+    def _serve_conn(self, conn):
+        f = conn.makefile('rb')
+        prompt = False
+        for line in iter(f.readline, ''):
+            command = line.strip()
+            if command == 'quit':
+                return
+            if command == 'prompt':
+                prompt = True
+            else:
+                self.commands.append(command)
+
+            reply = self._reply(command)
+            conn.sendall((reply + '\n' if reply else '') + ('\n> ' if prompt else '\n'))
+            if not prompt:
+                return
+
+    def _reply(self, command):
+        if command in self._replies:
+            return self._replies[command]
+        if command == 'prompt':
+            return ''
+        if not command.startswith('set server '):
+            return 'Unknown command.'
+        if ' addr ' in command:
+            return "IP changed from '10.0.0.1' to '10.0.0.2' by 'stats socket command'"
+        return ''
+
+
+def _detail(name, *nodes):
+    return ProxyDetail(name, nodes=[ProxyNode(uuid, addr, port) for uuid, addr, port in nodes])
+
+
+class _HAProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'haproxy.sock')
+        self.fake_haproxy = None
+
+    def tearDown(self):
+        if self.fake_haproxy:
+            self.fake_haproxy.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _serve(self, replies=None):
+        self.fake_haproxy = _FakeHAProxy(self.socket_path, replies)
+        return self.fake_haproxy
+
+
+class RuntimeApiTest(_HAProxyTest):
+    def test_execute(self):
+        fake_haproxy = self._serve()
+        replies = haproxy.RuntimeApi(self.socket_path).execute(['set server a/srv1 addr 10.0.0.2 port 80',
+                                                                 'set server a/srv1 weight 2'])
+
+        self.assertEqual(fake_haproxy.commands, ['set server a/srv1 addr 10.0.0.2 port 80',
+                                                 'set server a/srv1 weight 2'])
+        self.assertEqual(replies, ["IP changed from '10.0.0.1' to '10.0.0.2' by 'stats socket command'", ''])
+
+    def test_stop_at_rejected_command(self):
+        fake_haproxy = self._serve({'set server a/srv1 weight 2': 'No such server.'})
+        runtime_api = haproxy.RuntimeApi(self.socket_path)
+
+        self.assertRaises(haproxy.RuntimeApiError,
+                          runtime_api.execute,
+                          ['set server a/srv1 weight 2', 'set server a/srv1 state ready'],
+                          accepted=haproxy._is_accepted)
+        self.assertEqual(fake_haproxy.commands, ['set server a/srv1 weight 2'])
+
+    def test_accepted_replies(self):
+        self.assertTrue(haproxy._is_accepted('set server a/srv1 addr 10.0.0.1 port 80',
+                                             'no need to change the addr, no need to change the port'))
+        self.assertTrue(haproxy._is_accepted('set server a/srv1 weight 2', ''))
+        self.assertFalse(haproxy._is_accepted('set server a/srv1 addr 10.0.0.1 port 80', ''))
+        self.assertFalse(haproxy._is_accepted('set server a/srv1 state ready', 'Permission denied'))
+        self.assertFalse(haproxy._is_accepted('set server a/srv1 weight 2',
+                                              'Backend is using a static LB algorithm and only accepts weights '
+                                              "'0%' and '100%'."))
+
+
+class SlotDriverTest(_HAProxyTest):
+    def _reloaded_driver(self, *proxy_details):
+        slot_driver = haproxy.SlotDriver(self.socket_path, slots=2)
+        slot_driver.reloaded(slot_driver.assign(proxy_details))
+        return slot_driver
+
+    def test_assign_keeps_slots(self):
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80), ('n2', '10.0.0.2', 80)))
+
+        proxy_slots = slot_driver.assign([_detail('a', ('n0', '10.0.0.0', 80), ('n2', '10.0.0.2', 80))])
+        self.assertEqual([(it[0], it[1].uuid) for it in proxy_slots['a']], [('srv1', 'n0'), ('srv2', 'n2')])
+
+        proxy_slots = slot_driver.assign([_detail('a', ('n2', '10.0.0.2', 80))])
+        self.assertEqual([(it[0], it[1] and it[1].uuid) for it in proxy_slots['a']],
+                         [('srv1', None), ('srv2', 'n2')])
+
+    def test_assign_more_nodes_than_slots(self):
+        slot_driver = haproxy.SlotDriver(self.socket_path, slots=2)
+        proxy_slots = slot_driver.assign([_detail('a', ('n1', '10.0.0.1', 80),
+                                                  ('n2', '10.0.0.2', 80),
+                                                  ('n3', '10.0.0.3', 80))])
+        self.assertEqual([it[0] for it in proxy_slots['a']], ['srv1', 'srv2', 'srv3'])
+
+    def test_update_servers(self):
+        fake_haproxy = self._serve()
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+
+        proxy_slots = slot_driver.assign([_detail('a', ('n1', '10.0.0.2', 80))])
+        self.assertTrue(slot_driver.update(proxy_slots))
+        self.assertEqual(fake_haproxy.commands, ['set server a/srv1 addr 10.0.0.2 port 80',
+                                                 'set server a/srv1 weight 1',
+                                                 'set server a/srv1 state ready'])
+
+        # applied now, the same slots update nothing.
+        self.assertTrue(slot_driver.update(slot_driver.assign([_detail('a', ('n1', '10.0.0.2', 80))])))
+        self.assertEqual(len(fake_haproxy.commands), 3)
+
+        self.assertTrue(slot_driver.update(slot_driver.assign([_detail('a')])))
+        self.assertEqual(fake_haproxy.commands[3:], ['set server a/srv1 state maint'])
+
+    def test_reload_before_first_reload(self):
+        fake_haproxy = self._serve()
+        slot_driver = haproxy.SlotDriver(self.socket_path, slots=2)
+
+        self.assertFalse(slot_driver.update(slot_driver.assign([_detail('a', ('n1', '10.0.0.1', 80))])))
+        self.assertEqual(fake_haproxy.commands, [])
+
+    def test_reload_on_added_or_removed_domain(self):
+        fake_haproxy = self._serve()
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+
+        self.assertFalse(slot_driver.update(slot_driver.assign([_detail('a', ('n1', '10.0.0.1', 80)),
+                                                                _detail('b', ('n2', '10.0.0.2', 80))])))
+        self.assertFalse(slot_driver.update(slot_driver.assign([])))
+        self.assertEqual(fake_haproxy.commands, [])
+
+    def test_reload_on_more_nodes_than_slots(self):
+        fake_haproxy = self._serve()
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+
+        self.assertFalse(slot_driver.update(slot_driver.assign([_detail('a', ('n1', '10.0.0.1', 80),
+                                                                        ('n2', '10.0.0.2', 80),
+                                                                        ('n3', '10.0.0.3', 80))])))
+        self.assertEqual(fake_haproxy.commands, [])
+
+    def test_reload_on_rejected_command(self):
+        fake_haproxy = self._serve({'set server a/srv1 weight 1': 'No such server.'})
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+
+        proxy_slots = slot_driver.assign([_detail('a', ('n1', '10.0.0.2', 80))])
+        self.assertFalse(slot_driver.update(proxy_slots))
+        self.assertEqual(fake_haproxy.commands, ['set server a/srv1 addr 10.0.0.2 port 80',
+                                                 'set server a/srv1 weight 1'])
+
+        # not applied, the next update sends the change again.
+        self.assertFalse(slot_driver.update(proxy_slots))
+        self.assertEqual(len(fake_haproxy.commands), 4)
+
+    def test_reload_on_changed_fields_not_of_servers(self):
+        fake_haproxy = self._serve()
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+
+        changed_node = ProxyNode('n1', '10.0.0.2', 80, proto='https')
+        self.assertFalse(slot_driver.update(slot_driver.assign([ProxyDetail('a', nodes=[changed_node])])))
+        self.assertEqual(fake_haproxy.commands, [])
+
+    def test_applied_slots(self):
+        slot_driver = haproxy.SlotDriver(self.socket_path, slots=2)
+        self.assertIsNone(slot_driver.applied_slots())
+
+        proxy_slots = slot_driver.assign([_detail('a', ('n1', '10.0.0.1', 80))])
+        slot_driver.reloaded(proxy_slots)
+        self.assertEqual(slot_driver.applied_slots(), proxy_slots)
+
+    def test_reload_without_socket(self):
+        slot_driver = self._reloaded_driver(_detail('a', ('n1', '10.0.0.1', 80)))
+        self.assertFalse(slot_driver.update(slot_driver.assign([_detail('a', ('n1', '10.0.0.2', 80))])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import random
+import re
+import unittest
+
+from proxywall.matchers import *
+
+
+def _naive_match(redirect_rules, path):
+    # re.match over the rules, longest pattern first.
+    for pattern, redirect_url in sorted(set(redirect_rules), key=lambda it: (-len(it[0]), it[0], it[1])):
+        try:
+            if re.match(pattern, path):
+                return redirect_url
+        except re.error:
+            continue
+    return None
+
+
+class RedirectMatcherTest(unittest.TestCase):
+    def test_longest_pattern_first(self):
+        redirect_matcher = RedirectMatcher([('/a', 'http://a.com'),
+                                            ('/a/b', 'http://b.com'),
+                                            ('/a/[0-9]+', 'http://n.com')])
+
+        self.assertEqual(redirect_matcher.match('/a/b/c'), 'http://b.com')
+        self.assertEqual(redirect_matcher.match('/a/12'), 'http://n.com')
+        self.assertEqual(redirect_matcher.match('/a/x'), 'http://a.com')
+        self.assertIsNone(redirect_matcher.match('/b'))
+
+    def test_ignore_invalid_pattern(self):
+        redirect_matcher = RedirectMatcher([('/a(', 'http://a.com'), ('/a', 'http://b.com')])
+        self.assertEqual(redirect_matcher.match('/a('), 'http://b.com')
+
+    def test_unjoinable_patterns(self):
+        redirect_matcher = RedirectMatcher([('(?i)/upper', 'http://i.com'),
+                                            ('/(?P<x>a+)/(?P=x)', 'http://named.com'),
+                                            ('/(b)\\1', 'http://ref.com')])
+
+        self.assertEqual(redirect_matcher.match('/UPPER'), 'http://i.com')
+        self.assertEqual(redirect_matcher.match('/aa/aa'), 'http://named.com')
+        self.assertEqual(redirect_matcher.match('/bb'), 'http://ref.com')
+
+    def test_more_groups_than_one_regex(self):
+        redirect_rules = [('/r{}/(a)(b)?'.format(index), 'http://{}.com'.format(index)) for index in range(200)]
+        redirect_matcher = RedirectMatcher(redirect_rules)
+
+        for index in [0, 33, 34, 150, 199]:
+            self.assertEqual(redirect_matcher.match('/r{}/ab'.format(index)), 'http://{}.com'.format(index))
+
+    def test_cache(self):
+        redirect_matcher = RedirectMatcher([('/a', 'http://a.com')], cache_size=2)
+        for path in ['/a', '/b', '/a', '/c']:
+            redirect_matcher.match(path)
+
+        self.assertEqual(list(redirect_matcher._cache.keys()), ['/a', '/c'])
+        self.assertEqual(redirect_matcher.match('/a'), 'http://a.com')
+
+    def test_like_naive_match(self):
+        fuzz = random.Random(7)
+        patterns = ['/', '/a', '/a/b', '/a.b', '/a/[bc]', '/[a-z]+/c', '/a/b?', '/(a|b)/c', '/a/.*/d', '/a/b$',
+                    '/b', '/b/[0-9]+', '/(b)(c)?', '/c', '.*', '/c/d']
+        paths = ['/', '/a', '/a/b', '/a/c', '/axb', '/a/b/d', '/b/c', '/b/12', '/bc', '/c', '/c/d', '/x/c', '/d']
+
+        for _ in range(200):
+            redirect_rules = [(fuzz.choice(patterns), 'http://{}.com'.format(fuzz.randint(0, 3)))
+                              for _ in range(fuzz.randint(1, 8))]
+            redirect_matcher = RedirectMatcher(redirect_rules)
+            for path in paths:
+                self.assertEqual(redirect_matcher.match(path), _naive_match(redirect_rules, path),
+                                 (redirect_rules, path))
+
+
+class HostRedirectMatcherTest(unittest.TestCase):
+    redirect_rules = [('//a.example.com/x', 'http://exact.com'),
+                      ('//*.example.com/x', 'http://wildcard.com'),
+                      ('//*.b.example.com/x', 'http://sub-wildcard.com'),
+                      ('//*.example.com', 'http://all.com'),
+                      ('/x', 'http://default.com'),
+                      ('/y', 'http://y.com')]
+
+    def test_host_rules_first(self):
+        host_matcher = HostRedirectMatcher(self.redirect_rules)
+
+        self.assertEqual(host_matcher.match('a.example.com', '/x'), 'http://exact.com')
+        self.assertEqual(host_matcher.match('c.b.example.com', '/x'), 'http://sub-wildcard.com')
+        self.assertEqual(host_matcher.match('c.example.com', '/x'), 'http://wildcard.com')
+        self.assertEqual(host_matcher.match('c.example.com', '/z'), 'http://all.com')
+        self.assertEqual(host_matcher.match('example.com', '/x'), 'http://default.com')
+        self.assertEqual(host_matcher.match(None, '/y'), 'http://y.com')
+        self.assertIsNone(host_matcher.match('other.com', '/z'))
+
+    def test_normalize_host(self):
+        host_matcher = HostRedirectMatcher(self.redirect_rules)
+
+        self.assertEqual(host_matcher.match('A.Example.COM:8080', '/x'), 'http://exact.com')
+        self.assertEqual(host_matcher.match('a.example.com.', '/x'), 'http://exact.com')
+        self.assertEqual(host_matcher.match('[::1]:80', '/x'), 'http://default.com')
+
+    def test_replace(self):
+        host_matcher = HostRedirectMatcher(self.redirect_rules)
+        replaced_matcher = host_matcher.replace('A.example.com', [('/z', 'http://z.com')])
+
+        self.assertEqual(replaced_matcher.rules('a.example.com'), [('/z', 'http://z.com')])
+        self.assertEqual(replaced_matcher.match('a.example.com', '/z'), 'http://z.com')
+        self.assertEqual(replaced_matcher.match('a.example.com', '/x'), 'http://wildcard.com')
+        self.assertEqual(host_matcher.match('a.example.com', '/x'), 'http://exact.com')
+
+        removed_matcher = replaced_matcher.replace('*.example.com', [])
+        self.assertEqual(removed_matcher.match('c.example.com', '/x'), 'http://default.com')
+        self.assertEqual(removed_matcher.match('c.b.example.com', '/x'), 'http://sub-wildcard.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
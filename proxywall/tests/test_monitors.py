@@ -0,0 +1,314 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from proxywall import monitors
+from proxywall.backend import *
+from proxywall.errors import BackendError
+from proxywall.routes import RouteTable
+from proxywall.targets import ProxyTarget
+from proxywall.tests.test_haproxy import _FakeHAProxy
+
+
+class _FakeReload(object):
+    def __init__(self, *results):
+        self.results = list(results)
+        self.reloads = 0
+
+    def reload(self):
+        self.reloads += 1
+        return self.results.pop(0) if self.results else True
+
+
+def _context(*names):
+    route_table = RouteTable()
+    route_table.load(1, [ProxyEvent('set', name, name, ProxyNode(name, '10.0.0.1', 80), None) for name in names])
+    return route_table.context()
+
+
+class HandleProxyTest(unittest.TestCase):
+    def setUp(self):
+        monitors._applied_templates.clear()
+        monitors._applied_fragments.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _target(self, template_source, fragment_source=None, *reload_results):
+        template_src = os.path.join(self.tmp_dir, 'proxy.tpl')
+        with open(template_src, 'w') as f:
+            f.write(template_source)
+
+        fragment_src = None
+        if fragment_source:
+            fragment_src = os.path.join(self.tmp_dir, 'fragment.tpl')
+            with open(fragment_src, 'w') as f:
+                f.write(fragment_source)
+
+        proxy_target = ProxyTarget(template_src=template_src,
+                                   template_dest=os.path.join(self.tmp_dir, 'proxy.conf'),
+                                   fragment_src=fragment_src,
+                                   fragment_dest=os.path.join(self.tmp_dir, 'fragments'),
+                                   post_cmd='true')
+        return proxy_target._replace(reloader=_FakeReload(*reload_results))
+
+    def _handle(self, proxy_target, proxy_context):
+        return monitors._handle_proxy(proxy_target, proxy_context, None, None)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_skip_reload_when_not_changed(self):
+        proxy_target = self._target('{% for it in proxy_details %}{{ it.name }};{% endfor %}')
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertEqual(proxy_target.reloader.reloads, 1)
+        self.assertEqual(self._read(proxy_target.template_dest), 'a.com;')
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com', 'b.com')))
+        self.assertEqual(proxy_target.reloader.reloads, 2)
+        self.assertEqual(self._read(proxy_target.template_dest), 'a.com;b.com;')
+
+    def test_skip_reload_of_template_applied_before_start(self):
+        proxy_target = self._target('{% for it in proxy_details %}{{ it.name }};{% endfor %}')
+        with open(proxy_target.template_dest, 'w') as f:
+            f.write('a.com;')
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertEqual(proxy_target.reloader.reloads, 0)
+
+    def test_retry_failed_reload(self):
+        proxy_target = self._target('{% for it in proxy_details %}{{ it.name }};{% endfor %}', None, False)
+
+        self.assertFalse(self._handle(proxy_target, _context('a.com')))
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertEqual(proxy_target.reloader.reloads, 2)
+
+    def test_retry_failed_reload_of_removed_fragment(self):
+        proxy_target = self._target('include fragments;', '{{ proxy_detail.name }}', True, False)
+        fragment_dest = os.path.join(proxy_target.fragment_dest, 'b.com.conf')
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com', 'b.com')))
+        self.assertEqual(self._read(fragment_dest), 'b.com')
+
+        self.assertFalse(self._handle(proxy_target, _context('a.com')))
+        self.assertFalse(os.path.exists(fragment_dest))
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertTrue(self._handle(proxy_target, _context('a.com')))
+        self.assertEqual(proxy_target.reloader.reloads, 3)
+
+    def test_render_changed_fragments_only(self):
+        proxy_target = self._target('include fragments;', '{{ proxy_detail.name }}')
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com', 'b.com')))
+        fragment_stat = os.stat(os.path.join(proxy_target.fragment_dest, 'a.com.conf'))
+
+        self.assertTrue(self._handle(proxy_target, _context('a.com', 'b.com', 'c.com')))
+        self.assertEqual(os.stat(os.path.join(proxy_target.fragment_dest, 'a.com.conf')), fragment_stat)
+        self.assertEqual(self._read(os.path.join(proxy_target.fragment_dest, 'c.com.conf')), 'c.com')
+        self.assertEqual(proxy_target.reloader.reloads, 2)
+
+
+_HAPROXY_TEMPLATE = '''timeout {timeout}
+{{% for it in proxy_details %}}backend {{{{ it.name }}}}
+{{% for server, node in proxy_slots[it.name] %}}    server {{{{ server }}}} {{{{ node and node.addr }}}}
+{{% endfor %}}{{% endfor %}}'''
+
+
+class HandleHAProxyTest(unittest.TestCase):
+    def setUp(self):
+        monitors._applied_templates.clear()
+        monitors._applied_fragments.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.template_src = os.path.join(self.tmp_dir, 'haproxy.tpl')
+        self._write_template('30s')
+
+        socket_path = os.path.join(self.tmp_dir, 'haproxy.sock')
+        self.fake_haproxy = _FakeHAProxy(socket_path)
+        self.proxy_target = ProxyTarget(template_src=self.template_src,
+                                        template_dest=os.path.join(self.tmp_dir, 'haproxy.cfg'),
+                                        haproxy_socket=socket_path,
+                                        haproxy_slots=2,
+                                        post_cmd='true')._replace(reloader=_FakeReload())
+
+    def tearDown(self):
+        self.fake_haproxy.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_template(self, timeout):
+        with open(self.template_src, 'w') as f:
+            f.write(_HAPROXY_TEMPLATE.format(timeout=timeout))
+
+    def _handle(self, *nodes):
+        route_table = RouteTable()
+        route_table.load(1, [ProxyEvent('set', 'a.com', it.uuid, it, None) for it in nodes])
+        self.assertTrue(monitors._handle_proxy(self.proxy_target, route_table.context(), None, None))
+
+    def _read(self):
+        with open(self.proxy_target.template_dest) as f:
+            return f.read()
+
+    def test_update_servers_without_reload(self):
+        self._handle(ProxyNode('n1', '10.0.0.1', 80))
+        self._handle(ProxyNode('n1', '10.0.0.2', 80), ProxyNode('n2', '10.0.0.3', 80, weight=2))
+
+        self.assertEqual(self.proxy_target.reloader.reloads, 1)
+        self.assertEqual(self.fake_haproxy.commands, ['set server a.com/srv1 addr 10.0.0.2 port 80',
+                                                      'set server a.com/srv1 weight 1',
+                                                      'set server a.com/srv1 state ready',
+                                                      'set server a.com/srv2 addr 10.0.0.3 port 80',
+                                                      'set server a.com/srv2 weight 2',
+                                                      'set server a.com/srv2 state ready'])
+        self.assertIn('server srv2 10.0.0.3', self._read())
+
+        # applied, the same servers neither update nor reload.
+        self._handle(ProxyNode('n1', '10.0.0.2', 80), ProxyNode('n2', '10.0.0.3', 80, weight=2))
+        self.assertEqual(self.proxy_target.reloader.reloads, 1)
+        self.assertEqual(len(self.fake_haproxy.commands), 6)
+
+    def test_reload_changed_template(self):
+        self._handle(ProxyNode('n1', '10.0.0.1', 80))
+
+        # no server changed, nothing the runtime api could send.
+        self._write_template('5s')
+        self._handle(ProxyNode('n1', '10.0.0.1', 80))
+        self.assertEqual(self.proxy_target.reloader.reloads, 2)
+        self.assertTrue(self._read().startswith('timeout 5s'))
+
+        self._write_template('10s')
+        self._handle(ProxyNode('n1', '10.0.0.2', 80))
+        self.assertEqual(self.proxy_target.reloader.reloads, 3)
+        self.assertEqual(self.fake_haproxy.commands, [])
+
+    def test_reload_changed_fields_not_of_servers(self):
+        # the addr could go through the runtime api, the proto or redirect with it can not.
+        self._handle(ProxyNode('n1', '10.0.0.1', 80))
+        self._handle(ProxyNode('n1', '10.0.0.2', 80, proto='https'))
+        self._handle(ProxyNode('n1', '10.0.0.3', 80, proto='https', redirect='http://b.com'))
+
+        self.assertEqual(self.proxy_target.reloader.reloads, 3)
+        self.assertEqual(self.fake_haproxy.commands, [])
+
+    def test_reload_after_failed_reload(self):
+        self.proxy_target = self.proxy_target._replace(reloader=_FakeReload(True, False))
+        self._handle(ProxyNode('n1', '10.0.0.1', 80))
+
+        self._write_template('5s')
+        route_table = RouteTable()
+        route_table.load(1, [ProxyEvent('set', 'a.com', 'n1', ProxyNode('n1', '10.0.0.1', 80), None)])
+        self.assertFalse(monitors._handle_proxy(self.proxy_target, route_table.context(), None, None))
+
+        # the failed config is not applied, a server change must not skip its reload.
+        self._handle(ProxyNode('n1', '10.0.0.2', 80))
+        self.assertEqual(self.proxy_target.reloader.reloads, 3)
+        self.assertEqual(self.fake_haproxy.commands, [])
+
+
+class _FakeSnapshotBackend(object):
+    def __init__(self, *snapshots):
+        self.snapshots = list(snapshots)
+
+    def snapshot(self):
+        snapshot = self.snapshots.pop(0)
+        if isinstance(snapshot, Exception):
+            raise snapshot
+        return snapshot
+
+
+class _FakeEvents(object):
+    def __init__(self, *proxy_events):
+        self._proxy_events = list(proxy_events)
+
+    def get(self, timeout=None):
+        if not self._proxy_events:
+            raise KeyboardInterrupt
+        return self._proxy_events.pop(0)
+
+
+class LoopProxyTest(unittest.TestCase):
+    def test_resync_after_failed_snapshot(self):
+        route_table = RouteTable()
+        node = ProxyNode('n1', '10.0.0.1', 80)
+        backend = _FakeSnapshotBackend((1, [ProxyEvent('set', 'a.com', 'n1', node, 1)]),
+                                       BackendError(),
+                                       (5, [ProxyEvent('set', 'b.com', 'n1', node, 5)]))
+
+        proxy_events = _FakeEvents(ProxyEvent('resync', None, None, None, 4))
+        self.assertRaises(BackendError, monitors._loop_proxy, backend, route_table, proxy_events, [], 0, 0)
+        self.assertTrue(route_table.stale)
+
+        # restarted by the supervisor, the resync event is gone but the table is still loaded again.
+        self.assertRaises(KeyboardInterrupt, monitors._loop_proxy, backend, route_table, _FakeEvents(), [], 0, 0)
+        self.assertFalse(route_table.stale)
+        self.assertEqual((route_table.index, [it.name for it in route_table.details()]), (5, ['b.com']))
+
+
+class ProxyWorkerTest(unittest.TestCase):
+    def test_retry_failed_render(self):
+        handled = []
+        results = [False, False, True]
+        done = threading.Event()
+
+        def handler(proxy_context):
+            handled.append((time.time(), proxy_context))
+            if len(handled) == len(results):
+                done.set()
+            return results[len(handled) - 1]
+
+        proxy_worker = monitors._ProxyWorker(handler, min_retry=0.05, max_retry=0.1)
+        worker_thread = threading.Thread(target=proxy_worker.loop)
+        worker_thread.setDaemon(True)
+        worker_thread.start()
+
+        proxy_context = _context('a.com')
+        proxy_worker.submit(proxy_context)
+        self.assertTrue(done.wait(5))
+        time.sleep(0.2)
+
+        self.assertEqual(len(handled), 3)
+        self.assertGreaterEqual(handled[1][0] - handled[0][0], 0.05)
+        self.assertGreaterEqual(handled[2][0] - handled[1][0], 0.1)
+        self.assertTrue(all(it[1] is proxy_context for it in handled))
+
+    def test_render_latest_context(self):
+        handled = []
+        started, resumed = threading.Event(), threading.Event()
+
+        def handler(proxy_context):
+            handled.append(proxy_context)
+            started.set()
+            resumed.wait(5)
+
+        proxy_worker = monitors._ProxyWorker(handler)
+        worker_thread = threading.Thread(target=proxy_worker.loop)
+        worker_thread.setDaemon(True)
+        worker_thread.start()
+
+        proxy_worker.submit(_context('a.com'))
+        self.assertTrue(started.wait(5))
+
+        # both arrive while the first render runs, only the latest is rendered next.
+        proxy_worker.submit(_context('a.com', 'b.com'))
+        latest_context = _context('a.com', 'b.com', 'c.com')
+        proxy_worker.submit(latest_context)
+        resumed.set()
+
+        deadline = time.time() + 5
+        while len(handled) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        self.assertEqual(len(handled), 2)
+        self.assertIs(handled[1], latest_context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from proxywall import redirect
+from proxywall.backend import *
+
+
+class _FakeRequest(object):
+    def __init__(self, host, path):
+        self.path = path
+        self._host = host
+
+    def getHeader(self, name):
+        return self._host if name == 'host' else None
+
+
+def _redirect_url(redirect_dispatcher, host, path):
+    redirect_handler = redirect_dispatcher.getChild(None, _FakeRequest(host, path))
+    return redirect_handler._redirect_headers[0][1][0]
+
+
+class RedirectDispatcherTest(unittest.TestCase):
+    redirect_rules = [('//a.com/static', 'http://static.a.com'), ('/old', 'http://new.com')]
+
+    def _dispatcher(self):
+        return redirect.RedirectDispatcher('http://default.com', self.redirect_rules)
+
+    def test_update_host(self):
+        redirect_dispatcher = self._dispatcher()
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'a.com', '/x'), 'http://default.com')
+
+        self.assertTrue(redirect_dispatcher.update_host('a.com', ['http://b.com']))
+        self.assertFalse(redirect_dispatcher.update_host('a.com', ['http://b.com']))
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'a.com', '/x'), 'http://b.com')
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'A.com:80', '/static/1'), 'http://static.a.com')
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'c.com', '/old'), 'http://new.com')
+
+        self.assertTrue(redirect_dispatcher.update_host('a.com', []))
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'a.com', '/x'), 'http://default.com')
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'a.com', '/static/1'), 'http://static.a.com')
+
+    def test_update_host_like_update_backend(self):
+        updated_dispatcher, loaded_dispatcher = self._dispatcher(), self._dispatcher()
+        backend_urls = {'a.com': ('http://b.com',), 'c.com': ('http://d.com', 'http://e.com')}
+
+        updated_dispatcher.update_host('a.com', ['http://x.com'])
+        for domain, redirect_urls in backend_urls.items():
+            updated_dispatcher.update_host(domain, redirect_urls)
+        loaded_dispatcher.update_backend(backend_urls)
+        self.assertFalse(loaded_dispatcher.update_backend(backend_urls))
+
+        for host in ['a.com', 'c.com', 'x.com']:
+            for path in ['/', '/static/1', '/old']:
+                self.assertEqual(_redirect_url(updated_dispatcher, host, path),
+                                 _redirect_url(loaded_dispatcher, host, path))
+
+    def test_keep_backend_on_update(self):
+        redirect_dispatcher = self._dispatcher()
+        redirect_dispatcher.update_host('a.com', ['http://b.com'])
+        redirect_dispatcher.update([('/new', 'http://newer.com')])
+
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'a.com', '/static/1'), 'http://b.com')
+        self.assertEqual(_redirect_url(redirect_dispatcher, 'c.com', '/new'), 'http://newer.com')
+
+
+class BackendUrlsTest(unittest.TestCase):
+    def test_backend_urls(self):
+        proxy_details = [ProxyDetail('a.com', nodes=[ProxyNode('n1', '10.0.0.1', 80, redirect='http://b.com'),
+                                                     ProxyNode('n2', '10.0.0.2', 80, redirect='http://b.com')]),
+                         ProxyDetail('c.com', nodes=[ProxyNode('n3', '10.0.0.3', 80)])]
+        self.assertEqual(redirect._backend_urls(proxy_details), {'a.com': ('http://b.com',)})
+
+
+if __name__ == '__main__':
+    unittest.main()
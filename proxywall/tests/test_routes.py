@@ -0,0 +1,71 @@
+import unittest
+
+from proxywall.backend import *
+from proxywall.routes import RouteTable
+
+
+def _event(name, uuid, node=None, index=None):
+    return ProxyEvent('set' if node else 'delete', name, uuid, node, index)
+
+
+class RouteTableTest(unittest.TestCase):
+    def test_apply(self):
+        route_table = RouteTable()
+        route_table.load(10, [_event('a.com', 'n1', ProxyNode('n1', '10.0.0.1', 80))])
+        self.assertEqual((route_table.index, route_table.version), (10, 1))
+
+        # at or below the index of the snapshot.
+        self.assertFalse(route_table.apply(_event('a.com', 'n2', ProxyNode('n2', '10.0.0.2', 80), index=10)))
+
+        self.assertTrue(route_table.apply(_event('a.com', 'n2', ProxyNode('n2', '10.0.0.2', 80), index=11)))
+        self.assertFalse(route_table.apply(_event('a.com', 'n2', ProxyNode('n2', '10.0.0.2', 80), index=12)))
+        self.assertTrue(route_table.apply(_event('a.com', 'n2', ProxyNode('n2', '10.0.0.2', 81), index=13)))
+        self.assertEqual((route_table.index, route_table.version), (13, 3))
+        self.assertEqual(sorted((it.uuid, it.port) for it in route_table.nodes('a.com')), [('n1', 80), ('n2', 81)])
+
+        self.assertTrue(route_table.apply(_event('a.com', 'n1', index=14)))
+        self.assertFalse(route_table.apply(_event('a.com', 'n1', index=15)))
+        self.assertTrue(route_table.apply(_event('a.com', 'n2', index=16)))
+        self.assertEqual(route_table.details(), [])
+        self.assertEqual(route_table.nodes('a.com'), [])
+
+    def test_load_replaces_table(self):
+        route_table = RouteTable()
+        route_table.load(1, [_event('a.com', 'n1', ProxyNode('n1', '10.0.0.1', 80))])
+        route_table.load(5, [_event('b.com', 'n2', ProxyNode('n2', '10.0.0.2', 80))])
+
+        self.assertEqual([it.name for it in route_table.details()], ['b.com'])
+        self.assertEqual(route_table.index, 5)
+
+
+class RouteTableContextTest(unittest.TestCase):
+    def test_weights_of_strings(self):
+        route_table = RouteTable()
+        route_table.load(1, [
+            _event('a.example.com', 'n1', ProxyNode('n1', '10.0.0.1', 80, weight='5')),
+            _event('a.example.com', 'n2', ProxyNode('n2', '10.0.0.2', 80, weight='x')),
+            _event('a.example.com', 'n3', ProxyNode('n3', '10.0.0.3', 80, weight='-2')),
+            _event('b.example.com', 'n4', ProxyNode('n4', '10.0.0.4', 80)),
+        ])
+
+        proxy_context = route_table.context()
+        self.assertEqual(proxy_context['proxy_weights'], {'a.example.com': 7, 'b.example.com': 1})
+
+    def test_context_per_version(self):
+        route_table = RouteTable()
+        route_table.load(1, [_event('a.example.com', 'n1', ProxyNode('n1', '10.0.0.1', 80))])
+
+        proxy_context = route_table.context()
+        self.assertIs(route_table.context(), proxy_context)
+
+        route_table.apply(_event('b.example.com', 'n2', ProxyNode('n2', '10.0.0.2', 80, proto='https'), index=2))
+        changed_context = route_table.context()
+        self.assertIsNot(changed_context, proxy_context)
+        self.assertEqual([it.name for it in changed_context['proxy_details']], ['a.example.com', 'b.example.com'])
+        self.assertEqual([it.name for it in changed_context['proxy_protos']['https']], ['b.example.com'])
+        self.assertEqual([it.name for it in changed_context['proxy_suffixes']['example.com']],
+                         ['a.example.com', 'b.example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
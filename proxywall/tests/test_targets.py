@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from proxywall.targets import *
+
+
+class LoadTargetsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.template_src = os.path.join(self.tmp_dir, 'proxy.tpl')
+        with open(self.template_src, 'w') as f:
+            f.write('')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _target_dict(self, template_dest, fragment_dest=None):
+        target_dict = {'template_src': self.template_src,
+                       'template_dest': os.path.join(self.tmp_dir, template_dest),
+                       'post_cmd': 'true'}
+        if fragment_dest:
+            target_dict['fragment_src'] = self.template_src
+            target_dict['fragment_dest'] = os.path.join(self.tmp_dir, fragment_dest)
+        return target_dict
+
+    def _load(self, *target_dicts):
+        targets_file = os.path.join(self.tmp_dir, 'targets.json')
+        with open(targets_file, 'w') as f:
+            json.dump(list(target_dicts), f)
+        return load_targets(targets_file)
+
+    def test_load_targets(self):
+        proxy_targets = self._load(self._target_dict('a.conf', 'a'), self._target_dict('b.conf', 'b'))
+        self.assertEqual([it.name for it in proxy_targets],
+                         [os.path.join(self.tmp_dir, 'a.conf'), os.path.join(self.tmp_dir, 'b.conf')])
+
+    def test_reject_shared_template_dest(self):
+        self.assertRaises(ValueError, self._load, self._target_dict('a.conf'), self._target_dict('./a.conf'))
+
+    def test_reject_shared_fragment_dest(self):
+        self.assertRaises(ValueError, self._load, self._target_dict('a.conf', 'a'), self._target_dict('b.conf', 'a'))
+
+    def test_reject_template_dest_in_fragment_dest(self):
+        self.assertRaises(ValueError, self._load, self._target_dict('a.conf', 'a'), self._target_dict('a/b.conf'))
+
+    def test_reject_shared_dest_of_other_targets(self):
+        proxy_targets = self._load(self._target_dict('a.conf'))
+        proxy_targets.append(ProxyTarget.from_dict(self._target_dict('a.conf')))
+        self.assertRaises(ValueError, check_targets, proxy_targets)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+    serve a twisted site from several processes sharing one listening socket.
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from proxywall import constants
+from proxywall import loggers
+
+_logger = loggers.getlogger('p.Workers')
+
+
+def serve(site_factory, listen_host, listen_port, workers=None, worker_module=None, grace_seconds=5):
+    """
+    serve in this process, or as master of workers processes which accept on one socket.
+    every worker is a fresh python process, a forked reactor would share its poller with the master.
+
+    :param site_factory: builds the site, only called in processes which serve.
+    :param listen_host:
+    :param listen_port:
+    :param workers: processes to serve with, 1 or less serves in this process.
+    :param worker_module: module whose main() is run as a worker with the same arguments.
+    :param grace_seconds: seconds a stopping worker finishes its requests in.
+    :return:
+    """
+    worker_fd = os.getenv(constants.WORKER_FD_ENV)
+    if worker_fd:
+        _serve_worker(site_factory, int(worker_fd), grace_seconds)
+    elif workers and workers > 1:
+        _serve_master(listen_host, listen_port, workers, worker_module, grace_seconds)
+    else:
+        from twisted.internet import reactor
+        reactor.listenTCP(listen_port, site_factory(), interface=listen_host)
+        reactor.run()
+
+
+def _serve_worker(site_factory, worker_fd, grace_seconds):
+    from twisted.internet import reactor
+
+    # adoptStreamPort dups the fd, the inherited one is not needed anymore.
+    listen_port = reactor.adoptStreamPort(worker_fd, socket.AF_INET, site_factory())
+    os.close(worker_fd)
+
+    def stop_worker(signum, frame):
+        # stop accept at once, give requests in flight grace_seconds to finish.
+        reactor.callFromThread(listen_port.stopListening)
+        reactor.callFromThread(reactor.callLater, grace_seconds, reactor.stop)
+
+    # after twisted installed its own handlers, which would stop at once.
+    reactor.callWhenRunning(signal.signal, signal.SIGTERM, stop_worker)
+    reactor.run()
+
+
+def _serve_master(listen_host, listen_port, workers, worker_module, grace_seconds):
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind((listen_host, listen_port))
+    listen_socket.listen(socket.SOMAXCONN)
+    listen_socket.setblocking(False)
+
+    worker_cmd = [sys.executable, '-c', 'import sys; from {} import main; sys.exit(main())'.format(worker_module)]
+    worker_cmd.extend(sys.argv[1:])
+    worker_env = dict(os.environ)
+    worker_env[constants.WORKER_FD_ENV] = str(listen_socket.fileno())
+
+    signals = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: signals.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: signals.append(signum))
+    signal.signal(signal.SIGHUP, lambda signum, frame: signals.append(signum))
+
+    # worker slot -> (process, started at), and the replaced ones which still finish their requests.
+    worker_procs = {}
+    stopping_procs = []
+    while True:
+        stopping_procs = [it for it in stopping_procs if it.poll() is None]
+
+        for worker_slot in range(workers):
+            worker_proc, started_at = worker_procs.get(worker_slot, (None, 0))
+            if worker_proc and worker_proc.poll() is None:
+                continue
+
+            # a worker which dies right after start must not spin.
+            if time.time() - started_at < 1:
+                continue
+
+            if worker_proc:
+                _logger.w('worker %s exit with %s, restart it.', worker_proc.pid, worker_proc.returncode)
+
+            worker_proc = subprocess.Popen(worker_cmd, env=worker_env, close_fds=False)
+            worker_procs[worker_slot] = (worker_proc, time.time())
+            _logger.w('start worker %s on [tcp/%s:%s].', worker_proc.pid, listen_host, listen_port)
+
+        signum = signals.pop(0) if signals else None
+        if signum == signal.SIGHUP:
+            # start the new workers before the old ones stop, the socket never stops accept.
+            _logger.w('restart %s workers.', workers)
+            prev_procs = [it[0] for it in worker_procs.values()]
+            worker_procs = {}
+            for worker_slot in range(workers):
+                worker_proc = subprocess.Popen(worker_cmd, env=worker_env, close_fds=False)
+                worker_procs[worker_slot] = (worker_proc, time.time())
+            _stop_workers(prev_procs, grace_seconds, wait=False)
+            stopping_procs.extend(prev_procs)
+        elif signum:
+            _logger.w('stop %s workers on signal %s.', workers, signum)
+            _stop_workers([it[0] for it in worker_procs.values()] + stopping_procs, grace_seconds)
+            return
+
+        time.sleep(0.5)
+
+
+def _stop_workers(worker_procs, grace_seconds, wait=True):
+    for worker_proc in worker_procs:
+        if worker_proc.poll() is None:
+            worker_proc.send_signal(signal.SIGTERM)
+
+    if not wait:
+        return
+
+    # workers exit after grace_seconds, kill the ones which did not.
+    stop_deadline = time.time() + grace_seconds + 5
+    while time.time() < stop_deadline and [it for it in worker_procs if it.poll() is None]:
+        time.sleep(0.1)
+
+    for worker_proc in worker_procs:
+        if worker_proc.poll() is None:
+            _logger.w('kill worker %s.', worker_proc.pid)
+            worker_proc.kill()